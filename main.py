@@ -1,12 +1,27 @@
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional
 import sqlite3
 import uuid
 import datetime
 import json as json_module
 import time
+import zlib
+import hashlib
+import copy
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import heapq
+import math
+import itertools
+from collections import Counter, OrderedDict, deque
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, urlencode, parse_qsl
+from html import escape as escape_html
 
 from pydantic import BaseModel
 
@@ -15,12 +30,37 @@ import httpx
 from fastapi import FastAPI, Query, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
 
-from bs4 import BeautifulSoup, Comment
+from bs4 import BeautifulSoup, CData, Comment, NavigableString, Tag
 import json
 import html2text
 from youtube_transcript_api import YouTubeTranscriptApi
 import re
 
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import lxml.html
+    import lxml.etree
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    SELECTOLAX_AVAILABLE = True
+except ImportError:
+    SELECTOLAX_AVAILABLE = False
+
+try:
+    import websockets
+    WEBSOCKETS_AVAILABLE = True
+except ImportError:
+    WEBSOCKETS_AVAILABLE = False
+
 load_dotenv()
 
 SEARXNG_URL = os.getenv('SEARXNG_URL')
@@ -34,6 +74,11 @@ PROXY_PORT = os.getenv('PROXY_PORT')
 
 REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '30'))
 
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'true').lower() == 'true'
+
 FILTER_SEARCH_RESULT_BY_AI = os.getenv('FILTER_SEARCH_RESULT_BY_AI', 'false').lower() == 'true'
 
 AI_API_KEY = os.getenv('WEB2MD_LLM_API_KEY')
@@ -43,59 +88,289 @@ AI_BASE_URL = os.getenv('AI_BASE_URL', 'https://api.openai.com/v1')
 MAX_IMAGES_PER_SITE = int(os.getenv('MAX_IMAGES_PER_SITE', '3'))
 MIN_IMAGE_SIZE = int(os.getenv('MIN_IMAGE_SIZE', '256'))
 MAX_TOKENS_PER_REQUEST = int(os.getenv('MAX_TOKENS_PER_REQUEST', '100000'))
+SEARCH_MAX_TOKENS = int(os.getenv('SEARCH_MAX_TOKENS', str(MAX_TOKENS_PER_REQUEST)))
+QUERY_COMPRESSION = os.getenv('QUERY_COMPRESSION', 'false').lower() == 'true'
+QUERY_COMPRESSION_MAX_TOKENS = int(os.getenv('QUERY_COMPRESSION_MAX_TOKENS', '2000'))
+HTML_PARSER = os.getenv('HTML_PARSER', 'lxml').lower()
+# CPUs this process may run on (affinity-aware); container CPU quotas are not visible here, hence the cap.
+AVAILABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+CONVERSION_WORKERS = int(os.getenv('CONVERSION_WORKERS', str(min(4, AVAILABLE_CPUS))))
+CONVERSION_TIMEOUT = float(os.getenv('CONVERSION_TIMEOUT', '30'))
+CONVERSION_QUEUE_TIMEOUT = float(os.getenv('CONVERSION_QUEUE_TIMEOUT', '60'))
+
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', '5'))
+SEARCH_DEDUPLICATION = os.getenv('SEARCH_DEDUPLICATION', 'true').lower() == 'true'
+SEARCH_DUPLICATE_DISTANCE = int(os.getenv('SEARCH_DUPLICATE_DISTANCE', '3'))
+
+FETCH_HEDGING_ENABLED = os.getenv('FETCH_HEDGING_ENABLED', 'false').lower() == 'true'
+FETCH_HEDGE_PERCENTILE = float(os.getenv('FETCH_HEDGE_PERCENTILE', '0.9'))
+FETCH_HEDGE_MIN_DELAY = float(os.getenv('FETCH_HEDGE_MIN_DELAY', '1'))
+FETCH_HEDGE_INITIAL_DELAY = float(os.getenv('FETCH_HEDGE_INITIAL_DELAY', '5'))
+FETCH_MIN_CONTENT_WORDS = int(os.getenv('FETCH_MIN_CONTENT_WORDS', '20'))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+FETCH_ALLOWED_CONTENT_TYPES = [t.strip().lower() for t in os.getenv('FETCH_ALLOWED_CONTENT_TYPES', 'text/html,application/xhtml+xml,text/plain').split(',') if t.strip()]
+
+ROUTING_MIN_SAMPLES = int(os.getenv('ROUTING_MIN_SAMPLES', '3'))
+ROUTING_DIRECT_MIN_SUCCESS_RATE = float(os.getenv('ROUTING_DIRECT_MIN_SUCCESS_RATE', '0.5'))
+ROUTING_REPROBE_INTERVAL = int(os.getenv('ROUTING_REPROBE_INTERVAL', '86400'))
+
+HOST_MAX_CONCURRENCY = int(os.getenv('HOST_MAX_CONCURRENCY', '4'))
+HOST_RATE_PER_SECOND = float(os.getenv('HOST_RATE_PER_SECOND', '2'))
+HOST_BURST = int(os.getenv('HOST_BURST', '4'))
+HOST_MAX_RETRY_AFTER = int(os.getenv('HOST_MAX_RETRY_AFTER', '60'))
+
+BROWSERLESS_MAX_CONCURRENT = int(os.getenv('BROWSERLESS_MAX_CONCURRENT', '10'))
+BROWSERLESS_MAX_QUEUED = int(os.getenv('BROWSERLESS_MAX_QUEUED', '10'))
+BROWSERLESS_QUEUE_TIMEOUT = float(os.getenv('BROWSERLESS_QUEUE_TIMEOUT', str(REQUEST_TIMEOUT)))
+
+BROWSERLESS_BLOCK_RESOURCE_TYPES = [t.strip().lower() for t in os.getenv('BROWSERLESS_BLOCK_RESOURCE_TYPES', 'image,stylesheet,font,media,websocket').split(',') if t.strip()]
+BROWSERLESS_BLOCK_TRACKERS = os.getenv('BROWSERLESS_BLOCK_TRACKERS', 'true').lower() == 'true'
+BROWSERLESS_BLOCK_THIRD_PARTY_SCRIPTS = os.getenv('BROWSERLESS_BLOCK_THIRD_PARTY_SCRIPTS', 'false').lower() == 'true'
+
+BROWSERLESS_RENDER_WAIT = os.getenv('BROWSERLESS_RENDER_WAIT', 'adaptive').lower()
+BROWSERLESS_MAX_SETTLE_MS = int(os.getenv('BROWSERLESS_MAX_SETTLE_MS', '5000'))
+
+BROWSERLESS_CDP_ENABLED = os.getenv('BROWSERLESS_CDP_ENABLED', 'false').lower() == 'true'
+BROWSERLESS_CDP_POOL_SIZE = int(os.getenv('BROWSERLESS_CDP_POOL_SIZE', '8'))
+BROWSERLESS_CDP_CONTEXT_TTL = int(os.getenv('BROWSERLESS_CDP_CONTEXT_TTL', '600'))
+BROWSERLESS_CDP_SESSION_TIMEOUT = int(os.getenv('BROWSERLESS_CDP_SESSION_TIMEOUT', '3600'))
+
+CIRCUIT_DEFAULTS = {
+    "failure_rate": float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5')),
+    "min_calls": int(os.getenv('CIRCUIT_MIN_CALLS', '5')),
+    "window": float(os.getenv('CIRCUIT_WINDOW', '60')),
+    "open_seconds": float(os.getenv('CIRCUIT_OPEN_SECONDS', '30')),
+}
+# YouTube blocks are detected from the error and tripped directly; back off long enough to avoid a permanent ban.
+CIRCUIT_PROFILE_DEFAULTS = {
+    "youtube": {"open_seconds": 3600.0},
+}
+
+SEARXNG_CACHE_TTL = int(os.getenv('SEARXNG_CACHE_TTL', '300'))
+SEARXNG_CACHE_MAX_ENTRIES = int(os.getenv('SEARXNG_CACHE_MAX_ENTRIES', '1000'))
+
+MARKDOWN_CACHE_ENABLED = os.getenv('MARKDOWN_CACHE_ENABLED', 'true').lower() == 'true'
+MARKDOWN_CACHE_MAX_MB = int(os.getenv('MARKDOWN_CACHE_MAX_MB', '128'))
+MAIN_CONTENT_EXTRACTION = os.getenv('MAIN_CONTENT_EXTRACTION', 'false').lower() == 'true'
+BOILERPLATE_STRIPPING = os.getenv('BOILERPLATE_STRIPPING', 'true').lower() == 'true'
+BOILERPLATE_MIN_PAGES = int(os.getenv('BOILERPLATE_MIN_PAGES', '3'))
+BOILERPLATE_MAX_BLOCKS = int(os.getenv('BOILERPLATE_MAX_BLOCKS', '5000'))
+
+HTML2TEXT_OPTIONS = {
+    "ignore_links": False,
+    "ignore_tables": False,
+    "bypass_tables": False,
+    "ignore_images": False,
+    "protect_links": True,
+    "mark_code": True
+}
 
 AUTO_MAX_REQUESTS = int(os.getenv('AUTO_MAX_REQUESTS', '5'))
 AUTO_MAX_CONTEXT_TOKENS = int(os.getenv('AUTO_MAX_CONTEXT_TOKENS', '850000'))
 DB_CLEANUP_RETENTION_DAYS = int(os.getenv('DB_CLEANUP_RETENTION_DAYS', '90'))
 
-class YouTubeRateLimitManager:
-    _disabled_until = None
-    _disable_duration = 3600
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling failure-rate window.
+
+    The breaker opens when at least min_calls outcomes were recorded in the
+    last `window` seconds and the failure rate reaches failure_rate. After
+    open_seconds one probe call is let through (half-open): a success
+    closes the breaker, a failure re-opens it. trip() opens it directly
+    for callers that recognise an outage from the error itself.
+    """
+    def __init__(self, name: str, failure_rate: float, min_calls: int, window: float, open_seconds: float):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self.reason = None
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._open_for = open_seconds
+        self._probe_at = None
+        self._stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now: float, reason: str, duration: float = None):
+        self.state = 'open'
+        self.reason = reason
+        self._opened_at = now
+        self._open_for = duration if duration is not None else self.open_seconds
+        self._probe_at = None
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+        print(f"🚫 Circuit '{self.name}' opened for {self._open_for:.0f}s: {reason}")
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; an expired open breaker admits one probe."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'open' and now - self._opened_at >= self._open_for:
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                # A probe that never reported back must not wedge the breaker half-open.
+                if self._probe_at is None or now - self._probe_at >= self.open_seconds:
+                    self._probe_at = now
+                    self._stats["calls"] += 1
+                    return True
+            if self.state != 'closed':
+                self._stats["rejected"] += 1
+                return False
+            self._stats["calls"] += 1
+            return True
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open, retry in {self.remaining_cooldown()}s)")
+
+    def record_success(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'closed'
+                self.reason = None
+                self._outcomes.clear()
+                print(f"✅ Circuit '{self.name}' closed after a successful probe.")
+            elif self.state == 'closed':
+                self._outcomes.append((now, False))
+                self._prune(now)
+
+    def record_failure(self, reason: str = "failure rate exceeded"):
+        now = time.monotonic()
+        with self._lock:
+            self._stats["failures"] += 1
+            if self.state == 'half_open':
+                self._open(now, f"probe failed: {reason}")
+                return
+            if self.state != 'closed':
+                return
+            self._outcomes.append((now, True))
+            self._prune(now)
+            failures = sum(1 for _, failed in self._outcomes if failed)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now, reason)
+
+    def trip(self, reason: str, duration: float = None):
+        with self._lock:
+            self._open(time.monotonic(), reason, duration)
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == 'open' and time.monotonic() - self._opened_at < self._open_for
+
+    def remaining_cooldown(self) -> int:
+        with self._lock:
+            if self.state != 'open':
+                return 0
+            return max(0, int(self._opened_at + self._open_for - time.monotonic()))
+
+    def get_stats(self) -> dict:
+        remaining = self.remaining_cooldown()
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            failures = sum(1 for _, failed in self._outcomes if failed)
+            stats = dict(self._stats)
+            stats.update({
+                "state": 'half_open' if self.state == 'open' and remaining == 0 else self.state,
+                "reason": self.reason,
+                "cooldown_remaining_seconds": remaining,
+                "window_calls": len(self._outcomes),
+                "window_failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0
+            })
+            return stats
+
+class CircuitBreakers:
+    """Registry of breakers for upstream dependencies and origin hosts.
+
+    Each dependency reads its thresholds from CIRCUIT_DEFAULTS, then
+    CIRCUIT_PROFILE_DEFAULTS, then CIRCUIT_<PROFILE>_<SETTING> in the
+    environment; every origin host shares the 'host' profile.
+    """
+    _breakers = {}
+    _hosts = OrderedDict()
+    _max_tracked_hosts = 5000
     _lock = threading.Lock()
-    
-    @classmethod
-    def is_youtube_blocked_error(cls, error_message: str) -> bool:
-        blocking_indicators = [
-            "YouTube is blocking requests from your IP",
-            "You have done too many requests",
-            "IP has been blocked by YouTube",
-            "requests from an IP belonging to a cloud provider",
-            "most IPs from cloud providers are blocked"
-        ]
-        return any(indicator in str(error_message) for indicator in blocking_indicators)
-    
+
+    @staticmethod
+    def _config(profile: str) -> dict:
+        config = dict(CIRCUIT_DEFAULTS)
+        config.update(CIRCUIT_PROFILE_DEFAULTS.get(profile, {}))
+        for setting, value in config.items():
+            override = os.getenv(f"CIRCUIT_{profile.upper()}_{setting.upper()}")
+            if override is not None:
+                config[setting] = type(value)(override)
+        return config
+
     @classmethod
-    def disable_videos_temporarily(cls):
+    def get(cls, name: str) -> CircuitBreaker:
         with cls._lock:
-            cls._disabled_until = time.time() + cls._disable_duration
-            print(f"🚫 YouTube rate limit detected! Disabling video endpoint for {cls._disable_duration//60} minutes to prevent permanent ban.")
-    
+            breaker = cls._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **cls._config(name))
+                cls._breakers[name] = breaker
+            return breaker
+
     @classmethod
-    def is_videos_disabled(cls) -> bool:
+    def for_host(cls, url: str) -> CircuitBreaker:
+        host = (urlparse(url).hostname or "").lower()
         with cls._lock:
-            if cls._disabled_until is None:
-                return False
-            
-            if time.time() >= cls._disabled_until:
-                cls._disabled_until = None
-                print("✅ Video endpoint re-enabled after cooldown period.")
-                return False
-            
-            return True
-    
+            breaker = cls._hosts.get(host)
+            if breaker is None:
+                if len(cls._hosts) >= cls._max_tracked_hosts:
+                    for other, candidate in list(cls._hosts.items()):
+                        if candidate.state == 'closed':
+                            del cls._hosts[other]
+                            break
+                breaker = CircuitBreaker(f"host:{host}", **cls._config('host'))
+                cls._hosts[host] = breaker
+            cls._hosts.move_to_end(host)
+            return breaker
+
     @classmethod
-    def get_remaining_cooldown(cls) -> int:
+    def get_stats(cls) -> dict:
         with cls._lock:
-            if cls._disabled_until is None:
-                return 0
-            remaining = max(0, int(cls._disabled_until - time.time()))
-            return remaining
+            breakers = dict(cls._breakers)
+            hosts = dict(cls._hosts)
+        host_stats = {host: breaker.get_stats() for host, breaker in hosts.items()}
+        return {
+            "dependencies": {name: breaker.get_stats() for name, breaker in breakers.items()},
+            "hosts": {
+                "tracked": len(host_stats),
+                "not_closed": {host: stats for host, stats in host_stats.items() if stats["state"] != 'closed'}
+            }
+        }
+
+def is_youtube_blocked_error(error_message: str) -> bool:
+    blocking_indicators = [
+        "YouTube is blocking requests from your IP",
+        "You have done too many requests",
+        "IP has been blocked by YouTube",
+        "requests from an IP belonging to a cloud provider",
+        "most IPs from cloud providers are blocked"
+    ]
+    return any(indicator in str(error_message) for indicator in blocking_indicators)
 
+# Matched against the first label of the registrable domain (x.com -> "x"), never as a substring.
 domains_only_for_browserless = ["twitter", "x", "facebook", "ucarspro"]
 
 # Database setup
 DB_PATH = os.getenv('DB_PATH', "web2md.db")
 
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', os.path.join(os.path.dirname(DB_PATH), "page_cache.db"))
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', '3600'))
+PAGE_CACHE_MAX_MB = int(os.getenv('PAGE_CACHE_MAX_MB', '512'))
+
 def init_database():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
@@ -140,6 +415,51 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_status ON responses (status)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_steps_response_id ON response_steps (response_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS domain_routes (
+            domain TEXT PRIMARY KEY,
+            direct_attempts INTEGER DEFAULT 0,
+            direct_success_rate REAL DEFAULT 0.0,
+            direct_empty_rate REAL DEFAULT 0.0,
+            direct_latency REAL DEFAULT 0.0,
+            rendered_attempts INTEGER DEFAULT 0,
+            rendered_success_rate REAL DEFAULT 0.0,
+            rendered_latency REAL DEFAULT 0.0,
+            last_probe_at REAL DEFAULT 0.0,
+            updated_at REAL DEFAULT 0.0
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_profiles (
+            domain TEXT PRIMARY KEY,
+            wait TEXT NOT NULL DEFAULT 'adaptive',
+            settle_ms REAL DEFAULT 0.0,
+            samples INTEGER DEFAULT 0,
+            escalated_at REAL DEFAULT 0.0,
+            updated_at REAL DEFAULT 0.0
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS boilerplate_blocks (
+            domain TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            pages INTEGER DEFAULT 0,
+            last_seen REAL DEFAULT 0.0,
+            PRIMARY KEY (domain, fingerprint)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS boilerplate_pages (
+            domain TEXT NOT NULL,
+            page TEXT NOT NULL,
+            seen_at REAL DEFAULT 0.0,
+            PRIMARY KEY (domain, page)
+        )
+    ''')
+    
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_queue_status ON queue (status)')
     
     conn.commit()
@@ -293,10 +613,155 @@ class DatabaseManager:
         
         cursor.execute('DELETE FROM queue WHERE created_at < ?', (cutoff_date.isoformat(),))
         
+        cursor.execute('DELETE FROM boilerplate_blocks WHERE last_seen < ?', (cutoff_date.timestamp(),))
+        cursor.execute('DELETE FROM boilerplate_pages WHERE seen_at < ?', (cutoff_date.timestamp(),))
+        
         conn.commit()
         conn.close()
         print(f"Cleaned up {len(old_response_ids)} old records")
 
+class PageCache:
+    """Persistent URL-keyed cache of raw fetched HTML.
+
+    Entries are zlib-compressed in their own SQLite file next to DB_PATH,
+    carry a TTL plus the ETag/Last-Modified validators of the origin, and
+    are evicted least-recently-used once PAGE_CACHE_MAX_MB is exceeded.
+    """
+    _stats = {"hits": 0, "stale_hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def init():
+        conn = PageCache._connect()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS page_cache (
+                url TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                source TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_page_cache_last_accessed ON page_cache (last_accessed)')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _connect():
+        return sqlite3.connect(PAGE_CACHE_PATH, timeout=10)
+
+    @staticmethod
+    def _count(stat: str, amount: int = 1):
+        with PageCache._stats_lock:
+            PageCache._stats[stat] += amount
+
+    @staticmethod
+    def get(url: str) -> dict:
+        now = time.time()
+        conn = PageCache._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT content, source, etag, last_modified, expires_at FROM page_cache WHERE url = ?',
+            (url,)
+        )
+        row = cursor.fetchone()
+        if row:
+            cursor.execute('UPDATE page_cache SET last_accessed = ? WHERE url = ?', (now, url))
+            conn.commit()
+        conn.close()
+
+        if not row:
+            PageCache._count("misses")
+            return None
+
+        fresh = row[4] > now
+        PageCache._count("hits" if fresh else "stale_hits")
+        return {
+            'content': zlib.decompress(row[0]).decode('utf-8'),
+            'source': row[1],
+            'etag': row[2],
+            'last_modified': row[3],
+            'fresh': fresh
+        }
+
+    @staticmethod
+    def put(url: str, content: str, source: str, etag: str = None, last_modified: str = None):
+        now = time.time()
+        compressed = zlib.compress(content.encode('utf-8'))
+        conn = PageCache._connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO page_cache
+            (url, content, source, etag, last_modified, size, fetched_at, expires_at, last_accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (url, compressed, source, etag, last_modified, len(compressed), now, now + PAGE_CACHE_TTL, now))
+        conn.commit()
+        evicted = PageCache._evict(cursor)
+        conn.commit()
+        conn.close()
+        PageCache._count("stored")
+        if evicted:
+            PageCache._count("evicted", evicted)
+
+    @staticmethod
+    def refresh(url: str):
+        now = time.time()
+        conn = PageCache._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            'UPDATE page_cache SET expires_at = ?, last_accessed = ? WHERE url = ?',
+            (now + PAGE_CACHE_TTL, now, url)
+        )
+        conn.commit()
+        conn.close()
+        PageCache._count("revalidated")
+
+    @staticmethod
+    def _evict(cursor) -> int:
+        max_bytes = PAGE_CACHE_MAX_MB * 1024 * 1024
+        cursor.execute('SELECT COALESCE(SUM(size), 0) FROM page_cache')
+        total = cursor.fetchone()[0]
+        evicted = 0
+        while total > max_bytes:
+            cursor.execute('SELECT url, size FROM page_cache ORDER BY last_accessed LIMIT 100')
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                cursor.execute('DELETE FROM page_cache WHERE url = ?', (url,))
+                total -= size
+                evicted += 1
+                if total <= max_bytes:
+                    break
+        return evicted
+
+    @staticmethod
+    def get_stats() -> dict:
+        conn = PageCache._connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM page_cache')
+        entries, size = cursor.fetchone()
+        conn.close()
+        with PageCache._stats_lock:
+            stats = dict(PageCache._stats)
+        stats.update({
+            "enabled": PAGE_CACHE_ENABLED,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": PAGE_CACHE_MAX_MB * 1024 * 1024,
+            "ttl_seconds": PAGE_CACHE_TTL
+        })
+        return stats
+
+if PAGE_CACHE_ENABLED:
+    PageCache.init()
+
 class LLMDecision(BaseModel):
     should_continue: bool
     confidence: float  # 0.0 to 1.0
@@ -316,8 +781,8 @@ class AutoResearchResult(BaseModel):
 
 def create_decision_prompt(user_query: str, current_step: int, previous_summaries: List[str], total_tokens: int) -> str:
     videos_status = ""
-    if YouTubeRateLimitManager.is_videos_disabled():
-        remaining = YouTubeRateLimitManager.get_remaining_cooldown()
+    if CircuitBreakers.get('youtube').is_open():
+        remaining = CircuitBreakers.get('youtube').remaining_cooldown()
         videos_status = f"\n⚠️  IMPORTANT: 'videos' endpoint is temporarily DISABLED due to YouTube rate limiting (cooldown: {remaining//60} minutes remaining). DO NOT choose 'videos' as next_action."
     
     context = f"""
@@ -335,7 +800,7 @@ Your task is to decide whether you have enough information to provide a comprehe
 
 Available actions:
 - 'search': Get more web content (general articles, documentation, guides)
-- 'videos': Get video tutorials, demonstrations, or explanations{' (CURRENTLY DISABLED)' if YouTubeRateLimitManager.is_videos_disabled() else ''}
+- 'videos': Get video tutorials, demonstrations, or explanations{' (CURRENTLY DISABLED)' if CircuitBreakers.get('youtube').is_open() else ''}
 - 'images': Get visual content, diagrams, screenshots, or illustrations
 - 'stop': You have sufficient information to provide a comprehensive answer
 
@@ -572,7 +1037,7 @@ class AutoResearcher:
     @staticmethod
     def _call_search_endpoint(query: str, num_results: int = 5) -> dict:
         try:
-            result = search(query, num_results, json_response=True)
+            result = run_in_main_loop(search(query, num_results, json_response=True))
             if hasattr(result, 'body'):
                 import json
                 return json.loads(result.body.decode())
@@ -584,41 +1049,36 @@ class AutoResearcher:
     @staticmethod
     def _call_videos_endpoint(query: str, num_results: int = 3) -> dict:
         try:
-            if YouTubeRateLimitManager.is_videos_disabled():
-                remaining = YouTubeRateLimitManager.get_remaining_cooldown()
+            if CircuitBreakers.get('youtube').is_open():
+                remaining = CircuitBreakers.get('youtube').remaining_cooldown()
                 print(f"🚫 Skipping video search - disabled for {remaining//60} more minutes due to YouTube rate limiting")
                 return None
             
-            result_list = searxng(query, categories="videos")
+            result_list = run_in_main_loop(searxng(query, categories="videos"))
             results = result_list["results"] if isinstance(result_list, dict) and "results" in result_list else result_list
             
             if FILTER_SEARCH_RESULT_BY_AI:
                 try:
                     ai_input = {"query": query, "results": results}
-                    reranked_results = reranker_ai_videos(ai_input)
+                    reranked_results = run_in_main_loop(reranker_ai_videos(ai_input))
                     results = reranked_results["results"]
                 except Exception as e:
                     print(f"AI reranking failed for videos in auto-research: {e}")
             
             return results[:num_results]
         except Exception as e:
-            error_msg = str(e)
-            print(f"Videos endpoint error: {error_msg}")
-            
-            if YouTubeRateLimitManager.is_youtube_blocked_error(error_msg):
-                YouTubeRateLimitManager.disable_videos_temporarily()
-            
+            print(f"Videos endpoint error: {e}")
             return None
     
     @staticmethod
     def _call_images_endpoint(query: str, num_results: int = 5) -> dict:
         try:
-            result_list = searxng(query, categories="images")
+            result_list = run_in_main_loop(searxng(query, categories="images"))
             results = result_list["results"] if isinstance(result_list, dict) and "results" in result_list else result_list
             
             if FILTER_SEARCH_RESULT_BY_AI:
                 ai_input = {"query": query, "results": results}
-                reranked_results = reranker_ai_images(ai_input)
+                reranked_results = run_in_main_loop(reranker_ai_images(ai_input))
                 results = reranked_results["results"]
             
             return results[:num_results]
@@ -654,19 +1114,9 @@ class AutoResearcher:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                import openai
-                client = openai.OpenAI(
-                    api_key=AI_API_KEY,
-                    base_url=AI_BASE_URL,
-                    default_headers={
-                        "HTTP-Referer": "https://github.com/lucanori/web2md",
-                        "X-Title": "Web2MD"
-                    }
-                )
-                
                 prompt = create_decision_prompt(user_query, current_step, previous_summaries, total_tokens)
                 
-                response = client.chat.completions.create(
+                response = create_chat_completion_sync(
                     model=AI_MODEL,
                     messages=[
                         {
@@ -735,19 +1185,9 @@ class AutoResearcher:
             if not AI_API_KEY or not AI_BASE_URL:
                 raise Exception("AI credentials not available")
             
-            import openai
-            client = openai.OpenAI(
-                api_key=AI_API_KEY,
-                base_url=AI_BASE_URL,
-                default_headers={
-                    "HTTP-Referer": "https://github.com/lucanori/web2md",
-                    "X-Title": "Web2MD"
-                }
-            )
-            
             prompt = create_final_response_prompt(user_query, [], collected_data)
             
-            response = client.chat.completions.create(
+            response = create_chat_completion_sync(
                 model=AI_MODEL,
                 messages=[
                     {
@@ -825,36 +1265,36 @@ class AutoResearcher:
                         print(f"Retrying cost fetch for {message_id} (attempt {attempt}/{max_retries})")
                         time.sleep(retry_delay)
                     
-                    with httpx.Client() as client:
-                        response = client.get(
-                            f"https://openrouter.ai/api/v1/generation?id={message_id}",
-                            headers={
-                                "Authorization": f"Bearer {AI_API_KEY}",
-                                "Content-Type": "application/json"
-                            },
-                            timeout=15
-                        )
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            cost = data.get('data', {}).get('total_cost', 0.0)
-                            if cost:
-                                message_cost = float(cost)
-                                print(f"Message {message_id}: ${message_cost}")
-                                break
-                            else:
-                                print(f"No cost data in response for {message_id}")
-                        elif response.status_code == 404:
-                            if attempt < max_retries:
-                                print(f"Got 404 for {message_id}, will retry in {retry_delay}s...")
-                                continue
-                            else:
-                                message_cost = 0.1
-                                print(f"Failed to get cost for {message_id} after {max_retries} retries (404). Using fallback cost: ${message_cost}")
-                                break
+                    client = HTTPClientManager.get_client()
+                    response = client.get(
+                        f"https://openrouter.ai/api/v1/generation?id={message_id}",
+                        headers={
+                            "Authorization": f"Bearer {AI_API_KEY}",
+                            "Content-Type": "application/json"
+                        },
+                        timeout=15
+                    )
+                    
+                    if response.status_code == 200:
+                        data = response.json()
+                        cost = data.get('data', {}).get('total_cost', 0.0)
+                        if cost:
+                            message_cost = float(cost)
+                            print(f"Message {message_id}: ${message_cost}")
+                            break
                         else:
-                            print(f"Failed to get cost for message {message_id}: HTTP {response.status_code}")
+                            print(f"No cost data in response for {message_id}")
+                    elif response.status_code == 404:
+                        if attempt < max_retries:
+                            print(f"Got 404 for {message_id}, will retry in {retry_delay}s...")
+                            continue
+                        else:
+                            message_cost = 0.1
+                            print(f"Failed to get cost for {message_id} after {max_retries} retries (404). Using fallback cost: ${message_cost}")
                             break
+                    else:
+                        print(f"Failed to get cost for message {message_id}: HTTP {response.status_code}")
+                        break
                             
                 except Exception as e:
                     print(f"Error fetching cost for message {message_id}: {e}")
@@ -969,261 +1409,2583 @@ class CleanupScheduler:
                     except Exception as e:
                         print(f"Cleanup error: {e}")
 
-CleanupScheduler.start_cleanup_scheduler()
-
-app = FastAPI()
-
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-def get_proxies(without=False):
+def get_proxy_url():
     if PROXY_URL and PROXY_USERNAME and PROXY_PORT:
+        return f"{PROXY_PROTOCOL}://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_URL}:{PROXY_PORT}"
+    return None
+
+def get_proxies(without=False):
+    proxy_url = get_proxy_url()
+    if proxy_url:
         if without:
             return {
-                "http": f"{PROXY_PROTOCOL}://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_URL}:{PROXY_PORT}",
-                "https": f"{PROXY_PROTOCOL}://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_URL}:{PROXY_PORT}"
+                "http": proxy_url,
+                "https": proxy_url
             }
         return {
-            "http://": f"{PROXY_PROTOCOL}://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_URL}:{PROXY_PORT}",
-            "https://": f"{PROXY_PROTOCOL}://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_URL}:{PROXY_PORT}"
+            "http://": proxy_url,
+            "https://": proxy_url
         }
     return None
 
-def fetch_content(url):
-    proxies = get_proxies(without=True)
-    def fetch_normal_content(url):
-        try:
-            if proxies:
-                with httpx.Client(proxies=proxies) as client:
-                    response = client.get(
-                        url,
-                        headers=HEADERS,
-                        timeout=REQUEST_TIMEOUT,
-                        follow_redirects=True
-                    )
-            else:
-                response = httpx.get(
-                    url,
-                    headers=HEADERS,
-                    timeout=REQUEST_TIMEOUT,
-                    follow_redirects=True
+class HTTPClientManager:
+    """Application-scoped connection pools shared by every outbound call.
+
+    Pools are keyed by proxy so origin fetches can go through the scraping
+    proxy while SearXNG, Browserless and the LLM endpoint stay direct.
+    """
+    _clients = {}
+    _async_clients = {}
+    _ai_client = None
+    _async_ai_client = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _client_options(proxied: bool) -> dict:
+        options = {
+            "limits": httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            "http2": HTTP2_ENABLED and HTTP2_AVAILABLE,
+            "timeout": REQUEST_TIMEOUT
+        }
+        proxy_url = get_proxy_url() if proxied else None
+        if proxy_url:
+            options["proxy"] = proxy_url
+        return options
+
+    @classmethod
+    def get_client(cls, proxied: bool = False) -> httpx.Client:
+        key = get_proxy_url() if proxied else None
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.Client(**cls._client_options(proxied))
+                cls._clients[key] = client
+            return client
+
+    @classmethod
+    def get_async_client(cls, proxied: bool = False) -> httpx.AsyncClient:
+        key = get_proxy_url() if proxied else None
+        with cls._lock:
+            client = cls._async_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(**cls._client_options(proxied))
+                cls._async_clients[key] = client
+            return client
+
+    @classmethod
+    def get_ai_client(cls):
+        import openai
+        with cls._lock:
+            if cls._ai_client is None:
+                cls._ai_client = openai.OpenAI(
+                    api_key=AI_API_KEY,
+                    base_url=AI_BASE_URL,
+                    default_headers={
+                        "HTTP-Referer": "https://github.com/lucanori/web2md",
+                        "X-Title": "Web2MD"
+                    }
                 )
-            response.raise_for_status()
-            return response.text
-        except httpx.RequestError as e:
-            print(f"An error occurred while requesting {url}: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"HTTP error occurred: {e}")
-        return None
+            return cls._ai_client
 
-    def fetch_browserless_content(url):
-        try:
-            browserless_url = f"{BROWSERLESS_URL}/content"
-            params = {
-                "headless": False,
-                "stealth": True,
-            }
-            if TOKEN:
-                params['token'] = TOKEN
-
-            proxy_url = f"{PROXY_PROTOCOL}://{PROXY_URL}:{PROXY_PORT}" if PROXY_URL and PROXY_PORT else None
-            if proxy_url:
-                params['--proxy-server'] = proxy_url
-
-            browserless_data = {
-                "url": url,
-                "rejectResourceTypes": ["image", "stylesheet"],
-                "gotoOptions": {"waitUntil": "networkidle0", "timeout": REQUEST_TIMEOUT * 1000},
-                "bestAttempt": True,
-                "setJavaScriptEnabled": True,
-            }
-            if PROXY_USERNAME and PROXY_PASSWORD:
-                browserless_data["authenticate"] = {
-                    "username": PROXY_USERNAME,
-                    "password": PROXY_PASSWORD
-                }
+    @classmethod
+    def get_async_ai_client(cls):
+        import openai
+        with cls._lock:
+            if cls._async_ai_client is None:
+                cls._async_ai_client = openai.AsyncOpenAI(
+                    api_key=AI_API_KEY,
+                    base_url=AI_BASE_URL,
+                    default_headers={
+                        "HTTP-Referer": "https://github.com/lucanori/web2md",
+                        "X-Title": "Web2MD"
+                    }
+                )
+            return cls._async_ai_client
 
-            headers = {
-                'Cache-Control': 'no-cache',
-                'Content-Type': 'application/json'
-            }
+    @classmethod
+    async def close_all(cls):
+        with cls._lock:
+            clients = list(cls._clients.values())
+            async_clients = list(cls._async_clients.values())
+            ai_client = cls._ai_client
+            async_ai_client = cls._async_ai_client
+            cls._clients = {}
+            cls._async_clients = {}
+            cls._ai_client = None
+            cls._async_ai_client = None
 
-            response = httpx.post(browserless_url, params=params, headers=headers, data=json.dumps(browserless_data), timeout=REQUEST_TIMEOUT * 2)
-            response.raise_for_status()
-            return response.text
-        except httpx.RequestError as e:
-            print(f"An error occurred while requesting Browserless for {url}: {e}")
-        except httpx.HTTPStatusError as e:
-            print(f"HTTP error occurred with Browserless: {e}")
-        return None
+        for client in clients:
+            client.close()
+        for client in async_clients:
+            await client.aclose()
+        if ai_client is not None:
+            ai_client.close()
+        if async_ai_client is not None:
+            await async_ai_client.close()
+        print("HTTP connection pools closed")
 
-    if any(domain in url for domain in domains_only_for_browserless):
-        content = fetch_browserless_content(url)
-    else:
-        content = fetch_normal_content(url)
-        if content is None:
-            content = fetch_browserless_content(url)
+def _is_llm_outage(error: Exception) -> bool:
+    import openai
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError))
 
-    return content
+def create_chat_completion_sync(**kwargs):
+    """chat.completions.create on the shared client, behind the 'llm' circuit breaker."""
+    breaker = CircuitBreakers.get('llm')
+    breaker.check()
+    try:
+        response = HTTPClientManager.get_ai_client().chat.completions.create(**kwargs)
+    except Exception as e:
+        if _is_llm_outage(e):
+            breaker.record_failure(type(e).__name__)
+        raise
+    breaker.record_success()
+    return response
 
-def get_transcript(video_id: str, format: str = "markdown"):
+async def create_chat_completion(**kwargs):
+    """Async create_chat_completion_sync, on the shared AsyncOpenAI client."""
+    breaker = CircuitBreakers.get('llm')
+    breaker.check()
     try:
-        proxies = get_proxies(without=True)
-        if proxies:
-            try:
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies)
-            except TypeError:
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        else:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        transcript = " ".join([entry['text'] for entry in transcript_list])
+        response = await HTTPClientManager.get_async_ai_client().chat.completions.create(**kwargs)
+    except Exception as e:
+        if _is_llm_outage(e):
+            breaker.record_failure(type(e).__name__)
+        raise
+    breaker.record_success()
+    return response
 
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
-        video_page = fetch_content(video_url)
-        title = extract_title(video_page)
+_main_loop = None
 
-        if format == "json":
-            return JSONResponse({"url": video_url, "title": title, "transcript": transcript})
-        return PlainTextResponse(f"Title: {title}\n\nURL Source: {video_url}\n\nTranscript:\n{transcript}")
-    except Exception as e:
-        error_msg = str(e)
-        
-        if YouTubeRateLimitManager.is_youtube_blocked_error(error_msg):
-            YouTubeRateLimitManager.disable_videos_temporarily()
-        
-        return PlainTextResponse(f"Failed to retrieve transcript: {error_msg}")
+# 'interactive' for endpoint traffic, 'background' for auto-research work.
+request_priority = contextvars.ContextVar('request_priority', default='interactive')
 
-def extract_title(html_content):
-    if html_content:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        title = soup.find("title")
-        return title.string.replace(" - YouTube", "") if title else 'No title'
-    return 'No title'
+def run_in_main_loop(coro, priority: str = 'background'):
+    """Run a coroutine on the server event loop from a worker thread.
 
-def clean_html(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    for script_or_style in soup(["script", "style", "header", "footer", "noscript", "form", "input", "textarea", "select", "option", "button", "svg", "iframe", "object", "embed", "applet", "nav", "navbar"]):
-        script_or_style.decompose()
+    The auto-research queue runs in its own thread but shares the async
+    pipeline (and its connection pools) with the HTTP endpoints; its work
+    is tagged with a lower priority for shared resources like Browserless.
+    """
+    async def _run():
+        request_priority.set(priority)
+        return await coro
 
-    ids = ['layers']
-    
-    for id_ in ids:
-        tag = soup.find(id=id_)
-        if tag:
-            tag.decompose()
-    
-    for tag in soup.find_all(True):
-        tag.attrs = {key: value for key, value in tag.attrs.items() if key not in ['class', 'id', 'style']}
-    
-    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
-    
-    return str(soup)
+    loop = _main_loop
+    if loop is None or loop.is_closed() or not loop.is_running():
+        return asyncio.run(_run())
+    return asyncio.run_coroutine_threadsafe(_run(), loop).result()
 
-def estimate_tokens(text):
-    return len(text) // 4
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into one in-flight task.
 
-def filter_images_by_size_and_limit(html, base_url):
-    from bs4 import BeautifulSoup
-    from urllib.parse import urljoin, urlparse
-    
-    soup = BeautifulSoup(html, 'html.parser')
-    images = soup.find_all('img')
-    
-    if MAX_IMAGES_PER_SITE == 0:
-        for img in images:
-            img.decompose()
-        return str(soup)
-    
-    valid_images = []
-    
-    for img in images:
-        if len(valid_images) >= MAX_IMAGES_PER_SITE:
-            break
-            
-        src = img.get('src')
-        if not src:
-            continue
-            
-        if src.startswith('//'):
-            src = 'https:' + src
-        elif src.startswith('/'):
-            parsed_base = urlparse(base_url)
-            base_domain = f"{parsed_base.scheme}://{parsed_base.netloc}"
-            src = urljoin(base_domain, src)
-        
-        width = img.get('width')
-        height = img.get('height')
-        
-        if width and height:
-            try:
-                w, h = int(width), int(height)
-                if w >= MIN_IMAGE_SIZE and h >= MIN_IMAGE_SIZE:
-                    valid_images.append(img)
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        valid_images.append(img)
-    
-    for img in images:
-        if img not in valid_images:
-            img.decompose()
-    
-    return str(soup)
+    Followers await the leader's task through asyncio.shield, so a caller
+    that disconnects does not cancel the work the others are waiting on.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
 
-def parse_html_to_markdown(html, url, title=None):
-    cleaned_html = clean_html(html)
-    filtered_html = filter_images_by_size_and_limit(cleaned_html, url)
-    title_ = title or extract_title(html)
+    async def do(self, key, coro_factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
 
-    text_maker = html2text.HTML2Text()
-    text_maker.ignore_links = False
-    text_maker.ignore_tables = False
-    text_maker.bypass_tables = False
-    text_maker.ignore_images = False
-    text_maker.protect_links = True
-    text_maker.mark_code = True
-    
-    markdown_content = text_maker.handle(filtered_html)
-    
-    estimated_tokens = estimate_tokens(markdown_content)
-    if estimated_tokens > MAX_TOKENS_PER_REQUEST:
-        max_chars = MAX_TOKENS_PER_REQUEST * 4
-        markdown_content = markdown_content[:max_chars] + "\n\n[Content truncated due to token limit]"
-        print(f"Content truncated: {estimated_tokens} tokens estimated, limit is {MAX_TOKENS_PER_REQUEST}")
-    
-    return {
-        "title": title_,
+        self.calls += 1
+        task = asyncio.ensure_future(coro_factory())
+        self._inflight[key] = task
+
+        def _forget(finished):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+
+        task.add_done_callback(_forget)
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight)
+        }
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _main_loop
+    _main_loop = asyncio.get_running_loop()
+    CleanupScheduler.start_cleanup_scheduler()
+    await ConversionPool.start()
+    HTTPClientManager.get_client()
+    HTTPClientManager.get_client(proxied=True)
+    print(f"HTTP connection pools ready (http2={HTTP2_ENABLED and HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS})")
+    yield
+    _main_loop = None
+    await BrowserlessCDPPool.close()
+    await HTTPClientManager.close_all()
+    ConversionPool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "com.au", "net.au", "org.au", "edu.au",
+    "co.jp", "ne.jp", "or.jp", "co.nz", "org.nz", "co.in", "co.za", "co.kr", "com.br",
+    "com.mx", "com.ar", "com.cn", "com.hk", "com.sg", "com.tr", "com.tw", "github.io"
+}
+
+def registrable_domain(url: str) -> str:
+    """Approximate eTLD+1 of a URL (docs.python.org -> python.org)."""
+    host = (urlparse(url).hostname or "").lower().rstrip(".")
+    if not host or re.fullmatch(r"[\d.]+|\[?[0-9a-f:]+\]?", host):
+        return host
+    labels = host.split(".")
+    if len(labels) >= 3 and ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+class DomainRouter:
+    """Learned per-domain choice between direct fetches and Browserless.
+
+    Outcomes are tracked as exponentially weighted rates in the
+    domain_routes table. A domain is routed straight to Browserless once
+    its direct fetches mostly fail or come back without usable content,
+    and gets a direct re-probe every ROUTING_REPROBE_INTERVAL seconds.
+    """
+    _routes = None
+    _alpha = 0.2
+    _lock = threading.Lock()
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if cls._routes is not None:
+            return
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT domain, direct_attempts, direct_success_rate, direct_empty_rate, direct_latency,
+                   rendered_attempts, rendered_success_rate, rendered_latency, last_probe_at, updated_at
+            FROM domain_routes
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        routes = {}
+        for row in rows:
+            routes[row[0]] = {
+                'direct_attempts': row[1],
+                'direct_success_rate': row[2],
+                'direct_empty_rate': row[3],
+                'direct_latency': row[4],
+                'rendered_attempts': row[5],
+                'rendered_success_rate': row[6],
+                'rendered_latency': row[7],
+                'last_probe_at': row[8],
+                'updated_at': row[9]
+            }
+        with cls._lock:
+            if cls._routes is None:
+                cls._routes = routes
+
+    @staticmethod
+    def _new_route() -> dict:
+        return {
+            'direct_attempts': 0,
+            'direct_success_rate': 0.0,
+            'direct_empty_rate': 0.0,
+            'direct_latency': 0.0,
+            'rendered_attempts': 0,
+            'rendered_success_rate': 0.0,
+            'rendered_latency': 0.0,
+            'last_probe_at': 0.0,
+            'updated_at': 0.0
+        }
+
+    @staticmethod
+    def is_browserless_only(domain: str) -> bool:
+        return domain.split(".")[0] in domains_only_for_browserless
+
+    @classmethod
+    def choose(cls, url: str) -> str:
+        """Return 'direct', 'probe' (direct attempt on a Browserless domain) or 'browserless'."""
+        domain = registrable_domain(url)
+        if cls.is_browserless_only(domain):
+            return 'browserless'
+
+        cls._ensure_loaded()
+        now = time.time()
+        with cls._lock:
+            route = cls._routes.get(domain)
+            if route is None or route['direct_attempts'] < ROUTING_MIN_SAMPLES:
+                return 'direct'
+            usable_rate = route['direct_success_rate'] - route['direct_empty_rate']
+            if usable_rate >= ROUTING_DIRECT_MIN_SUCCESS_RATE:
+                return 'direct'
+            if now - route['last_probe_at'] >= ROUTING_REPROBE_INTERVAL:
+                route['last_probe_at'] = now
+                return 'probe'
+            return 'browserless'
+
+    @classmethod
+    async def record(cls, url: str, strategy: str, result, latency: float):
+        domain = registrable_domain(url)
+        if not domain:
+            return
+        ok = 1.0 if result else 0.0
+        empty = 1.0 if result and not result['not_modified'] and not is_usable_content(result['content']) else 0.0
+
+        cls._ensure_loaded()
+        alpha = cls._alpha
+        with cls._lock:
+            route = cls._routes.setdefault(domain, cls._new_route())
+            if strategy == 'direct':
+                # The first sample seeds the averages instead of being damped by alpha.
+                weight = 1.0 if route['direct_attempts'] == 0 else alpha
+                route['direct_attempts'] += 1
+                route['direct_success_rate'] += weight * (ok - route['direct_success_rate'])
+                route['direct_empty_rate'] += weight * (empty - route['direct_empty_rate'])
+                route['direct_latency'] += weight * (latency - route['direct_latency'])
+                route['last_probe_at'] = time.time()
+            else:
+                weight = 1.0 if route['rendered_attempts'] == 0 else alpha
+                route['rendered_attempts'] += 1
+                route['rendered_success_rate'] += weight * (ok * (1.0 - empty) - route['rendered_success_rate'])
+                route['rendered_latency'] += weight * (latency - route['rendered_latency'])
+            route['updated_at'] = time.time()
+            snapshot = dict(route)
+
+        await asyncio.to_thread(cls._persist, domain, snapshot)
+
+    @staticmethod
+    def _persist(domain: str, route: dict):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO domain_routes
+            (domain, direct_attempts, direct_success_rate, direct_empty_rate, direct_latency,
+             rendered_attempts, rendered_success_rate, rendered_latency, last_probe_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            domain, route['direct_attempts'], route['direct_success_rate'], route['direct_empty_rate'],
+            route['direct_latency'], route['rendered_attempts'], route['rendered_success_rate'],
+            route['rendered_latency'], route['last_probe_at'], route['updated_at']
+        ))
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        cls._ensure_loaded()
+        with cls._lock:
+            routes = dict(cls._routes)
+        browserless_routed = [
+            domain for domain, route in routes.items()
+            if route['direct_attempts'] >= ROUTING_MIN_SAMPLES
+            and route['direct_success_rate'] - route['direct_empty_rate'] < ROUTING_DIRECT_MIN_SUCCESS_RATE
+        ]
+        return {
+            "domains": len(routes),
+            "browserless_routed": len(browserless_routed),
+            "browserless_domains": sorted(browserless_routed)[:50],
+            "browserless_only": domains_only_for_browserless
+        }
+
+class HostBlockedError(Exception):
+    pass
+
+class HostScheduler:
+    """Per-host politeness: a FIFO concurrency cap plus a token bucket.
+
+    Every origin request waits for a slot on its host. A 429/503 with
+    Retry-After pauses the whole host; pauses longer than
+    HOST_MAX_RETRY_AFTER fail fast with HostBlockedError instead of
+    holding the caller.
+    """
+    _hosts = {}
+    _stats = {"requests": 0, "throttled": 0, "retry_after_waits": 0, "rejected": 0}
+    _default_backoff = 10
+    _max_tracked_hosts = 5000
+
+    @classmethod
+    def _state(cls, host: str) -> dict:
+        state = cls._hosts.get(host)
+        if state is None:
+            if len(cls._hosts) >= cls._max_tracked_hosts:
+                cls._prune()
+            state = {
+                "semaphore": asyncio.Semaphore(max(1, HOST_MAX_CONCURRENCY)),
+                "tokens": float(max(1, HOST_BURST)),
+                "refilled_at": time.monotonic(),
+                "blocked_until": 0.0,
+                "active": 0
+            }
+            cls._hosts[host] = state
+        return state
+
+    @classmethod
+    def _prune(cls):
+        now = time.monotonic()
+        idle = [
+            host for host, state in cls._hosts.items()
+            if state["active"] == 0 and state["blocked_until"] <= now
+        ]
+        for host in idle:
+            del cls._hosts[host]
+
+    @classmethod
+    async def _take_token(cls, state: dict):
+        if HOST_RATE_PER_SECOND <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            state["tokens"] = min(
+                float(max(1, HOST_BURST)),
+                state["tokens"] + (now - state["refilled_at"]) * HOST_RATE_PER_SECOND
+            )
+            state["refilled_at"] = now
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return
+            cls._stats["throttled"] += 1
+            await asyncio.sleep((1 - state["tokens"]) / HOST_RATE_PER_SECOND)
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(cls, url: str):
+        host = (urlparse(url).hostname or "").lower()
+        state = cls._state(host)
+        state["active"] += 1
+        try:
+            async with state["semaphore"]:
+                wait = state["blocked_until"] - time.monotonic()
+                if wait > HOST_MAX_RETRY_AFTER:
+                    cls._stats["rejected"] += 1
+                    raise HostBlockedError(f"{host} asked us to back off for another {int(wait)}s")
+                if wait > 0:
+                    cls._stats["retry_after_waits"] += 1
+                    await asyncio.sleep(wait)
+                await cls._take_token(state)
+                cls._stats["requests"] += 1
+                yield
+        finally:
+            state["active"] -= 1
+
+    @classmethod
+    def note_response(cls, url: str, response: httpx.Response):
+        if response.status_code not in (429, 503):
+            return
+        delay = cls._parse_retry_after(response.headers.get('retry-after'))
+        if delay is None:
+            if response.status_code != 429:
+                return
+            delay = cls._default_backoff
+        host = (urlparse(url).hostname or "").lower()
+        state = cls._state(host)
+        state["blocked_until"] = max(state["blocked_until"], time.monotonic() + delay)
+        print(f"{host} answered {response.status_code}, pausing requests for {delay:.0f}s")
+
+    @staticmethod
+    def _parse_retry_after(value):
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at is None:
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        now = time.monotonic()
+        blocked = {
+            host: int(state["blocked_until"] - now)
+            for host, state in cls._hosts.items()
+            if state["blocked_until"] > now
+        }
+        stats = dict(cls._stats)
+        stats.update({
+            "tracked_hosts": len(cls._hosts),
+            "active_hosts": sum(1 for state in cls._hosts.values() if state["active"]),
+            "paused_hosts": blocked
+        })
+        return stats
+
+class UnsupportedContentError(Exception):
+    pass
+
+async def read_capped_body(url, response) -> str:
+    """Stream a response body, refusing non-document types and stopping at FETCH_MAX_BYTES.
+
+    Oversized documents keep their first FETCH_MAX_BYTES, which is more
+    than the token budget can use anyway; binary bodies are abandoned
+    before they are downloaded.
+    """
+    content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type and content_type not in FETCH_ALLOWED_CONTENT_TYPES:
+        raise UnsupportedContentError(f"{url} is {content_type}, not a supported document type")
+    content_length = response.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > FETCH_MAX_BYTES:
+        print(f"{url} is {content_length} bytes, reading only the first {FETCH_MAX_BYTES}")
+
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        if not body and not content_type and b'\x00' in chunk[:1024]:
+            raise UnsupportedContentError(f"{url} has no Content-Type and looks binary")
+        body.extend(chunk)
+        if len(body) >= FETCH_MAX_BYTES:
+            del body[FETCH_MAX_BYTES:]
+            print(f"Truncated {url} at {FETCH_MAX_BYTES} bytes")
+            break
+    return body.decode(response.encoding or 'utf-8', errors='replace')
+
+async def fetch_normal_content(url, cached=None):
+    """Fetch a page directly through the (optionally proxied) pool.
+
+    When a cached copy with validators is passed the request is made
+    conditional, and a 304 answer is reported as ``not_modified``.
+    Raises UnsupportedContentError for non-document responses, which no
+    other fetch strategy would do better on.
+    """
+    headers = dict(HEADERS)
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    breaker = CircuitBreakers.for_host(url)
+    if not breaker.allow():
+        print(f"Skipping direct fetch of {url}: {breaker.name} circuit is open")
+        return None
+
+    started = time.monotonic()
+    result = None
+    try:
+        client = HTTPClientManager.get_async_client(proxied=True)
+        async with HostScheduler.slot(url):
+            started = time.monotonic()
+            async with client.stream(
+                "GET",
+                url,
+                headers=headers,
+                timeout=REQUEST_TIMEOUT,
+                follow_redirects=True
+            ) as response:
+                HostScheduler.note_response(url, response)
+                if response.status_code >= 500:
+                    breaker.record_failure(f"HTTP {response.status_code}")
+                else:
+                    breaker.record_success()
+                if cached and response.status_code == 304:
+                    result = {"content": cached['content'], "source": "direct", "not_modified": True}
+                else:
+                    response.raise_for_status()
+                    result = {
+                        "content": await read_capped_body(url, response),
+                        "source": "direct",
+                        "etag": response.headers.get('etag'),
+                        "last_modified": response.headers.get('last-modified'),
+                        "not_modified": False
+                    }
+        FetchHedging.record_latency(time.monotonic() - started)
+    except httpx.RequestError as e:
+        print(f"An error occurred while requesting {url}: {e}")
+        breaker.record_failure(type(e).__name__)
+    except httpx.HTTPStatusError as e:
+        print(f"HTTP error occurred: {e}")
+    except HostBlockedError as e:
+        print(f"Skipping direct fetch of {url}: {e}")
+        return None
+    await DomainRouter.record(url, 'direct', result, time.monotonic() - started)
+    return result
+
+class BrowserlessUnavailableError(Exception):
+    pass
+
+class BrowserlessAdmission:
+    """Client-side admission control sized to the Browserless container.
+
+    At most BROWSERLESS_MAX_CONCURRENT sessions run at once and at most
+    BROWSERLESS_MAX_QUEUED callers wait, ordered by request priority.
+    When the queue is full an interactive caller evicts the newest
+    background waiter; otherwise the caller is rejected immediately so it
+    can fail fast or return partial results.
+    """
+    _priorities = {'interactive': 0, 'background': 1}
+    _active = 0
+    _waiters = []
+    _sequence = itertools.count()
+    _stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "preempted": 0}
+
+    @classmethod
+    def _pending_waiters(cls) -> list:
+        cls._waiters = [entry for entry in cls._waiters if not entry[2].done()]
+        heapq.heapify(cls._waiters)
+        return cls._waiters
+
+    @classmethod
+    def _release(cls):
+        cls._active -= 1
+        while cls._waiters:
+            _, _, waiter = heapq.heappop(cls._waiters)
+            if not waiter.done():
+                cls._active += 1
+                waiter.set_result(True)
+                return
+
+    @classmethod
+    @asynccontextmanager
+    async def admit(cls):
+        priority = cls._priorities.get(request_priority.get(), 0)
+
+        if cls._active < BROWSERLESS_MAX_CONCURRENT and not cls._pending_waiters():
+            cls._active += 1
+        else:
+            waiters = cls._pending_waiters()
+            if len(waiters) >= BROWSERLESS_MAX_QUEUED:
+                lowest = max(waiters) if waiters else None
+                if lowest is None or lowest[0] <= priority:
+                    cls._stats["rejected"] += 1
+                    raise BrowserlessUnavailableError("Browserless queue is full")
+                waiters.remove(lowest)
+                heapq.heapify(waiters)
+                lowest[2].set_exception(BrowserlessUnavailableError("Displaced by a higher priority request"))
+                cls._stats["preempted"] += 1
+
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(cls._waiters, (priority, next(cls._sequence), waiter))
+            cls._stats["queued"] += 1
+            try:
+                await asyncio.wait_for(waiter, BROWSERLESS_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                cls._stats["timed_out"] += 1
+                raise BrowserlessUnavailableError(f"Waited {BROWSERLESS_QUEUE_TIMEOUT:.0f}s for a Browserless session")
+            except asyncio.CancelledError:
+                # A slot handed to us just before cancellation must be passed on.
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    cls._release()
+                raise
+
+        cls._stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            cls._release()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = dict(cls._stats)
+        stats.update({
+            "active": cls._active,
+            "waiting": len(cls._pending_waiters()),
+            "max_concurrent": BROWSERLESS_MAX_CONCURRENT,
+            "max_queued": BROWSERLESS_MAX_QUEUED
+        })
+        return stats
+
+RENDER_READY_FUNCTION = (
+    "() => { const root = document.querySelector('main, article, [role=\"main\"]') || document.body;"
+    " return !!root && root.innerText.trim().split(/\\s+/).length >= %d; }" % FETCH_MIN_CONTENT_WORDS
+)
+
+class RenderProfiles:
+    """Per-domain wait profile for rendered fetches, persisted in render_profiles.
+
+    The 'adaptive' profile navigates to domcontentloaded and then waits at
+    most a settle budget for the main content to carry enough text; the
+    budget follows an EWMA of the domain's observed settle times, capped
+    at BROWSERLESS_MAX_SETTLE_MS. A domain whose adaptive render comes back
+    unusable is escalated to 'networkidle0' and retried adaptively again
+    after ROUTING_REPROBE_INTERVAL seconds.
+    """
+    _profiles = None
+    _alpha = 0.2
+    _min_settle_ms = 500
+    _settle_headroom = 2.0
+    _lock = threading.Lock()
+    _stats = {"adaptive": 0, "networkidle0": 0, "escalations": 0}
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if cls._profiles is not None:
+            return
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT domain, wait, settle_ms, samples, escalated_at, updated_at FROM render_profiles')
+        rows = cursor.fetchall()
+        conn.close()
+        profiles = {}
+        for row in rows:
+            profiles[row[0]] = {
+                'wait': row[1],
+                'settle_ms': row[2],
+                'samples': row[3],
+                'escalated_at': row[4],
+                'updated_at': row[5]
+            }
+        with cls._lock:
+            if cls._profiles is None:
+                cls._profiles = profiles
+
+    @classmethod
+    def plan(cls, url: str) -> dict:
+        """Return the wait strategy and settle budget (ms) for a rendered fetch of url."""
+        if BROWSERLESS_RENDER_WAIT != 'adaptive':
+            return {"wait": "networkidle0", "settle_ms": BROWSERLESS_MAX_SETTLE_MS}
+
+        cls._ensure_loaded()
+        with cls._lock:
+            profile = cls._profiles.get(registrable_domain(url))
+            if profile is not None and profile['wait'] == 'networkidle0':
+                if time.time() - profile['escalated_at'] < ROUTING_REPROBE_INTERVAL:
+                    cls._stats["networkidle0"] += 1
+                    return {"wait": "networkidle0", "settle_ms": BROWSERLESS_MAX_SETTLE_MS}
+            settle_ms = BROWSERLESS_MAX_SETTLE_MS
+            if profile is not None and profile['samples'] > 0:
+                settle_ms = min(BROWSERLESS_MAX_SETTLE_MS, max(cls._min_settle_ms, profile['settle_ms'] * cls._settle_headroom))
+            cls._stats["adaptive"] += 1
+            return {"wait": "adaptive", "settle_ms": settle_ms}
+
+    @classmethod
+    async def record(cls, url: str, plan: dict, content, settle_ms: float = None) -> bool:
+        """Learn from a rendered fetch; returns True when the domain was escalated."""
+        domain = registrable_domain(url)
+        if not domain or content is None:
+            return False
+        usable = is_usable_content(content)
+        escalated = False
+
+        cls._ensure_loaded()
+        with cls._lock:
+            profile = cls._profiles.setdefault(domain, {
+                'wait': 'adaptive', 'settle_ms': 0.0, 'samples': 0, 'escalated_at': 0.0, 'updated_at': 0.0
+            })
+            if plan['wait'] == 'adaptive':
+                if usable:
+                    profile['wait'] = 'adaptive'
+                    if settle_ms is not None:
+                        weight = 1.0 if profile['samples'] == 0 else cls._alpha
+                        profile['samples'] += 1
+                        profile['settle_ms'] += weight * (settle_ms - profile['settle_ms'])
+                else:
+                    profile['wait'] = 'networkidle0'
+                    profile['escalated_at'] = time.time()
+                    cls._stats["escalations"] += 1
+                    escalated = True
+            elif not usable:
+                return False
+            profile['updated_at'] = time.time()
+            snapshot = dict(profile)
+
+        await asyncio.to_thread(cls._persist, domain, snapshot)
+        return escalated
+
+    @staticmethod
+    def _persist(domain: str, profile: dict):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO render_profiles (domain, wait, settle_ms, samples, escalated_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (domain, profile['wait'], profile['settle_ms'], profile['samples'], profile['escalated_at'], profile['updated_at']))
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        cls._ensure_loaded()
+        with cls._lock:
+            profiles = dict(cls._profiles)
+            stats = dict(cls._stats)
+        settled = [profile['settle_ms'] for profile in profiles.values() if profile['samples'] > 0]
+        stats.update({
+            "mode": BROWSERLESS_RENDER_WAIT,
+            "max_settle_ms": BROWSERLESS_MAX_SETTLE_MS,
+            "domains": len(profiles),
+            "networkidle0_domains": sorted(domain for domain, profile in profiles.items() if profile['wait'] == 'networkidle0')[:50],
+            "avg_settle_ms": round(sum(settled) / len(settled)) if settled else None
+        })
+        return stats
+
+# Ad, analytics and tracker hosts never needed for page content (matched on the host and its subdomains).
+TRACKER_BLOCKLIST = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "googletagmanager.com",
+    "googletagservices.com", "google-analytics.com", "adservice.google.com", "analytics.google.com",
+    "amazon-adsystem.com", "adnxs.com", "adsrvr.org", "rubiconproject.com", "pubmatic.com", "openx.net",
+    "casalemedia.com", "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "teads.tv",
+    "sharethrough.com", "moatads.com", "media.net", "yieldmo.com", "33across.com", "smartadserver.com",
+    "scorecardresearch.com", "quantserve.com", "chartbeat.com", "chartbeat.net", "parsely.com",
+    "hotjar.com", "fullstory.com", "mouseflow.com", "crazyegg.com", "clarity.ms", "mixpanel.com",
+    "amplitude.com", "segment.io", "cdn.segment.com", "heapanalytics.com", "optimizely.com", "nr-data.net",
+    "krxd.net", "bluekai.com", "demdex.net", "omtrdc.net", "everesttech.net", "connect.facebook.net",
+    "facebook.com/tr", "bat.bing.com", "ads-twitter.com", "static.ads-twitter.com", "analytics.twitter.com",
+    "analytics.tiktok.com", "snap.licdn.com", "px.ads.linkedin.com", "ct.pinterest.com", "sc-static.net",
+    "yandex.ru/metrika", "mc.yandex.ru", "cdn.mxpnl.com", "cdn.onesignal.com", "adform.net", "serving-sys.com",
+)
+
+class RequestBlocking:
+    """Blocking policy for sub-requests of rendered pages.
+
+    Requests are rejected by resource type (BROWSERLESS_BLOCK_RESOURCE_TYPES),
+    by host against the bundled TRACKER_BLOCKLIST and, when enabled, when
+    they are scripts served from another registrable domain than the page.
+    The CDP mode applies the policy per request and counts what it
+    blocked; /content gets the equivalent rejectResourceTypes and
+    rejectRequestPattern options.
+    """
+    _stats = {"fetches": 0, "requests": 0, "blocked": 0, "by_reason": {"type": 0, "tracker": 0, "third_party_script": 0}}
+
+    _trackers = [entry.partition("/")[::2] for entry in TRACKER_BLOCKLIST]
+
+    @classmethod
+    def is_tracker(cls, request_url: str) -> bool:
+        parsed = urlparse(request_url)
+        host = (parsed.hostname or "").lower()
+        for domain, path in cls._trackers:
+            if (host == domain or host.endswith("." + domain)) and parsed.path.lstrip("/").startswith(path):
+                return True
+        return False
+
+    @classmethod
+    def classify(cls, request_url: str, resource_type: str, page_domain: str):
+        """Return the reason a sub-request should be blocked, or None to let it through."""
+        resource_type = resource_type.lower()
+        if resource_type == "document":
+            return None
+        if resource_type in BROWSERLESS_BLOCK_RESOURCE_TYPES:
+            return "type"
+        if BROWSERLESS_BLOCK_TRACKERS and cls.is_tracker(request_url):
+            return "tracker"
+        if BROWSERLESS_BLOCK_THIRD_PARTY_SCRIPTS and resource_type == "script" and registrable_domain(request_url) != page_domain:
+            return "third_party_script"
+        return None
+
+    @classmethod
+    def content_options(cls, url: str) -> dict:
+        """rejectResourceTypes / rejectRequestPattern equivalent of the policy for /content."""
+        options = {"rejectResourceTypes": list(BROWSERLESS_BLOCK_RESOURCE_TYPES)}
+        patterns = []
+        if BROWSERLESS_BLOCK_TRACKERS:
+            hosts = "|".join(re.escape(domain) + ("/" + re.escape(path) if path else "(?::\\d+)?/") for domain, path in cls._trackers)
+            patterns.append(f"^https?://([^/]+\\.)?({hosts})")
+        if BROWSERLESS_BLOCK_THIRD_PARTY_SCRIPTS:
+            domain = re.escape(registrable_domain(url))
+            patterns.append(f"^https?://(?!([^/]+\\.)?{domain}(?::\\d+)?/)[^/]+/[^?#]*\\.m?js([?#]|$)")
+        if patterns:
+            options["rejectRequestPattern"] = patterns
+        return options
+
+    @classmethod
+    def record(cls, url: str, counters: dict):
+        blocked = sum(counters["by_reason"].values())
+        cls._stats["fetches"] += 1
+        cls._stats["requests"] += counters["requests"]
+        cls._stats["blocked"] += blocked
+        for reason, count in counters["by_reason"].items():
+            cls._stats["by_reason"][reason] += count
+        if counters["requests"]:
+            details = ", ".join(f"{reason}={count}" for reason, count in counters["by_reason"].items() if count)
+            print(f"Blocked {blocked}/{counters['requests']} requests for {url}" + (f" ({details})" if details else ""))
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = copy.deepcopy(cls._stats)
+        stats.update({
+            "resource_types": list(BROWSERLESS_BLOCK_RESOURCE_TYPES),
+            "trackers": BROWSERLESS_BLOCK_TRACKERS,
+            "tracker_hosts": len(TRACKER_BLOCKLIST),
+            "third_party_scripts": BROWSERLESS_BLOCK_THIRD_PARTY_SCRIPTS
+        })
+        return stats
+
+def browserless_params() -> dict:
+    params = {
+        "headless": False,
+        "stealth": True,
+    }
+    if TOKEN:
+        params['token'] = TOKEN
+
+    proxy_url = f"{PROXY_PROTOCOL}://{PROXY_URL}:{PROXY_PORT}" if PROXY_URL and PROXY_PORT else None
+    if proxy_url:
+        params['--proxy-server'] = proxy_url
+    return params
+
+class CDPError(Exception):
+    pass
+
+class BrowserlessCDPPool:
+    """Warm browser contexts held over one Browserless CDP websocket.
+
+    A single long-lived browser session replaces the per-fetch browser
+    launch of /content. Each registrable domain gets its own incognito
+    context so cookies and consent state survive between fetches; the
+    least recently used context is disposed once BROWSERLESS_CDP_POOL_SIZE
+    is exceeded or after BROWSERLESS_CDP_CONTEXT_TTL seconds idle. Every
+    fetch opens a fresh tab in its domain's context and closes it after.
+    """
+    _connection = None
+    _connect_lock = None
+    _ids = itertools.count(1)
+    _pending = {}
+    _listeners = {}
+    _contexts = OrderedDict()
+    _context_locks = {}
+    _stats = {"connects": 0, "fetches": 0, "failures": 0, "context_hits": 0, "context_misses": 0, "contexts_evicted": 0}
+
+    @staticmethod
+    def _websocket_url() -> str:
+        base = BROWSERLESS_URL.rstrip('/')
+        base = re.sub(r'^http', 'ws', base)
+        params = {key: str(value).lower() if isinstance(value, bool) else value for key, value in browserless_params().items()}
+        params['timeout'] = BROWSERLESS_CDP_SESSION_TIMEOUT * 1000
+        return f"{base}?{urlencode(params)}"
+
+    @classmethod
+    async def _ensure_connected(cls):
+        if cls._connection is not None:
+            return
+        if cls._connect_lock is None:
+            cls._connect_lock = asyncio.Lock()
+        async with cls._connect_lock:
+            if cls._connection is not None:
+                return
+            # The page HTML is sliced to FETCH_MAX_BYTES characters in the browser; a character
+            # can take up to six bytes once UTF-8 and JSON escaping are applied.
+            connection = await websockets.connect(cls._websocket_url(), max_size=FETCH_MAX_BYTES * 6 + 64 * 1024, open_timeout=REQUEST_TIMEOUT)
+            cls._connection = connection
+            cls._contexts.clear()
+            cls._stats["connects"] += 1
+            asyncio.create_task(cls._read_loop(connection))
+
+    @classmethod
+    async def _read_loop(cls, connection):
+        try:
+            async for raw in connection:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = cls._pending.pop(message["id"], None)
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CDPError(message["error"].get("message", "CDP error")))
+                    else:
+                        future.set_result(message.get("result", {}))
+                else:
+                    listener = cls._listeners.get(message.get("sessionId"))
+                    if listener is not None:
+                        listener.put_nowait((message.get("method"), message.get("params", {})))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if cls._connection is connection:
+                cls._connection = None
+                cls._contexts.clear()
+            for message_id, future in list(cls._pending.items()):
+                if not future.done():
+                    future.set_exception(CDPError("CDP connection closed"))
+                cls._pending.pop(message_id, None)
+            print("Browserless CDP connection closed")
+
+    @classmethod
+    async def _send(cls, method: str, params: dict = None, session_id: str = None, wait: bool = True):
+        connection = cls._connection
+        if connection is None:
+            raise CDPError("CDP connection is not open")
+        message_id = next(cls._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        if not wait:
+            await connection.send(json.dumps(message))
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        cls._pending[message_id] = future
+        try:
+            await connection.send(json.dumps(message))
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            cls._pending.pop(message_id, None)
+
+    @classmethod
+    async def _acquire_context(cls, domain: str) -> str:
+        # One creator per domain: concurrent fetches of a new domain would otherwise each create
+        # a context, and the ones overwritten in _contexts would live until the session ends.
+        lock = cls._context_locks.get(domain)
+        if lock is None:
+            lock = cls._context_locks[domain] = [asyncio.Lock(), 0]
+        lock[1] += 1
+        try:
+            async with lock[0]:
+                return await cls._acquire_context_locked(domain)
+        finally:
+            lock[1] -= 1
+            if not lock[1] and cls._context_locks.get(domain) is lock:
+                del cls._context_locks[domain]
+
+    @classmethod
+    async def _acquire_context_locked(cls, domain: str) -> str:
+        now = time.monotonic()
+        entry = cls._contexts.get(domain)
+        if entry is not None and now - entry["last_used"] > BROWSERLESS_CDP_CONTEXT_TTL and not entry["in_use"]:
+            await cls._dispose_context(domain)
+            entry = None
+
+        if entry is None:
+            cls._stats["context_misses"] += 1
+            result = await cls._send("Target.createBrowserContext", {"disposeOnDetach": False})
+            entry = {"id": result["browserContextId"], "last_used": now, "in_use": 0}
+            cls._contexts[domain] = entry
+        else:
+            cls._stats["context_hits"] += 1
+
+        # Claim the context before evicting: other domains' acquisitions run while disposals are awaited.
+        cls._contexts.move_to_end(domain)
+        entry["last_used"] = now
+        entry["in_use"] += 1
+        for other in [key for key, value in cls._contexts.items() if not value["in_use"]]:
+            if len(cls._contexts) <= BROWSERLESS_CDP_POOL_SIZE:
+                break
+            if other in cls._contexts and not cls._contexts[other]["in_use"]:
+                await cls._dispose_context(other)
+                cls._stats["contexts_evicted"] += 1
+        return entry["id"]
+
+    @classmethod
+    def _release_context(cls, domain: str, context_id: str):
+        entry = cls._contexts.get(domain)
+        if entry is not None and entry["id"] == context_id:
+            entry["in_use"] -= 1
+            entry["last_used"] = time.monotonic()
+
+    @classmethod
+    async def _dispose_context(cls, domain: str):
+        entry = cls._contexts.pop(domain, None)
+        if entry is None:
+            return
+        try:
+            await cls._send("Target.disposeBrowserContext", {"browserContextId": entry["id"]})
+        except CDPError as e:
+            print(f"Error disposing browser context for {domain}: {e}")
+
+    @classmethod
+    async def _pump_events(cls, session_id: str, events: asyncio.Queue, lifecycle: dict, changed: asyncio.Event, page_domain: str, counters: dict):
+        while cls._connection is not None:
+            method, params = await events.get()
+            if method == "Fetch.requestPaused":
+                counters["requests"] += 1
+                reason = RequestBlocking.classify(params.get("request", {}).get("url", ""), params.get("resourceType", ""), page_domain)
+                if reason:
+                    counters["by_reason"][reason] += 1
+                    await cls._send("Fetch.failRequest", {"requestId": params["requestId"], "errorReason": "BlockedByClient"}, session_id, wait=False)
+                else:
+                    await cls._send("Fetch.continueRequest", {"requestId": params["requestId"]}, session_id, wait=False)
+            elif method == "Fetch.authRequired":
+                await cls._send("Fetch.continueWithAuth", {
+                    "requestId": params["requestId"],
+                    "authChallengeResponse": {
+                        "response": "ProvideCredentials",
+                        "username": PROXY_USERNAME,
+                        "password": PROXY_PASSWORD
+                    }
+                }, session_id, wait=False)
+            elif method == "Page.lifecycleEvent":
+                lifecycle.setdefault(params.get("loaderId"), set()).add(params.get("name"))
+                changed.set()
+
+    @staticmethod
+    async def _wait_lifecycle(lifecycle: dict, changed: asyncio.Event, loader_id: str, name: str, deadline: float) -> bool:
+        while name not in lifecycle.get(loader_id, ()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            changed.clear()
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    @classmethod
+    async def fetch(cls, url: str, plan: dict):
+        """Render url in its domain's context; returns (html, settle_ms or None)."""
+        await cls._ensure_connected()
+        domain = registrable_domain(url)
+        context_id = await cls._acquire_context(domain)
+        target_id = None
+        session_id = None
+        pump = None
+        counters = {"requests": 0, "by_reason": {"type": 0, "tracker": 0, "third_party_script": 0}}
+        cls._stats["fetches"] += 1
+        try:
+            target = await cls._send("Target.createTarget", {"url": "about:blank", "browserContextId": context_id})
+            target_id = target["targetId"]
+            attached = await cls._send("Target.attachToTarget", {"targetId": target_id, "flatten": True})
+            session_id = attached["sessionId"]
+
+            events = asyncio.Queue()
+            cls._listeners[session_id] = events
+            lifecycle = {}
+            changed = asyncio.Event()
+            pump = asyncio.create_task(cls._pump_events(session_id, events, lifecycle, changed, domain, counters))
+
+            await cls._send("Page.enable", session_id=session_id)
+            await cls._send("Page.setLifecycleEventsEnabled", {"enabled": True}, session_id)
+            await cls._send("Fetch.enable", {
+                "patterns": [{"urlPattern": "*", "requestStage": "Request"}],
+                "handleAuthRequests": bool(PROXY_USERNAME and PROXY_PASSWORD)
+            }, session_id)
+
+            navigation = await cls._send("Page.navigate", {"url": url}, session_id)
+            if navigation.get("errorText"):
+                print(f"Browserless CDP navigation failed for {url}: {navigation['errorText']}")
+                cls._stats["failures"] += 1
+                return None, None
+
+            loader_id = navigation.get("loaderId")
+            deadline = time.monotonic() + REQUEST_TIMEOUT
+            settle_ms = None
+            if plan['wait'] == 'adaptive':
+                await cls._wait_lifecycle(lifecycle, changed, loader_id, "DOMContentLoaded", deadline)
+                settle_started = time.monotonic()
+                settle_deadline = min(deadline, settle_started + plan['settle_ms'] / 1000)
+                while True:
+                    ready = await cls._send("Runtime.evaluate", {
+                        "expression": f"({RENDER_READY_FUNCTION})()",
+                        "returnByValue": True
+                    }, session_id)
+                    if ready.get("result", {}).get("value"):
+                        settle_ms = (time.monotonic() - settle_started) * 1000
+                        break
+                    if time.monotonic() >= settle_deadline:
+                        break
+                    await asyncio.sleep(0.1)
+            else:
+                # networkidle0 with bestAttempt, but never settling longer than the cap after load.
+                await cls._wait_lifecycle(lifecycle, changed, loader_id, "load", deadline)
+                settle_deadline = min(deadline, time.monotonic() + plan['settle_ms'] / 1000)
+                await cls._wait_lifecycle(lifecycle, changed, loader_id, "networkIdle", settle_deadline)
+
+            evaluated = await cls._send("Runtime.evaluate", {
+                "expression": f"document.documentElement.outerHTML.slice(0, {FETCH_MAX_BYTES + 1})",
+                "returnByValue": True
+            }, session_id)
+            html = evaluated.get("result", {}).get("value")
+            if html is not None:
+                encoded = html.encode('utf-8', errors='surrogatepass')
+                if len(encoded) > FETCH_MAX_BYTES:
+                    html = encoded[:FETCH_MAX_BYTES].decode('utf-8', errors='ignore')
+                    print(f"Truncated {url} at {FETCH_MAX_BYTES} bytes")
+            return html, settle_ms
+        except (CDPError, asyncio.TimeoutError, KeyError):
+            cls._stats["failures"] += 1
+            raise
+        finally:
+            if pump is not None:
+                pump.cancel()
+                RequestBlocking.record(url, counters)
+            cls._listeners.pop(session_id, None)
+            if target_id is not None and cls._connection is not None:
+                try:
+                    await cls._send("Target.closeTarget", {"targetId": target_id}, wait=False)
+                except websockets.ConnectionClosed:
+                    pass
+            cls._release_context(domain, context_id)
+
+    @classmethod
+    async def close(cls):
+        connection = cls._connection
+        cls._connection = None
+        cls._contexts.clear()
+        if connection is not None:
+            await connection.close()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = dict(cls._stats)
+        stats.update({
+            "enabled": BROWSERLESS_CDP_ENABLED and WEBSOCKETS_AVAILABLE,
+            "connected": cls._connection is not None,
+            "contexts": len(cls._contexts),
+            "pool_size": BROWSERLESS_CDP_POOL_SIZE
+        })
+        return stats
+
+async def fetch_browserless_content(url):
+    if not CircuitBreakers.get('browserless').allow():
+        print(f"Browserless circuit is open, not rendering {url}")
+        return None
+    try:
+        async with BrowserlessAdmission.admit():
+            plan = RenderProfiles.plan(url)
+            content, settle_ms = await render_browserless_content(url, plan)
+            if await RenderProfiles.record(url, plan, content, settle_ms):
+                print(f"Adaptive render of {url} was not usable, retrying with networkidle0")
+                plan = {"wait": "networkidle0", "settle_ms": BROWSERLESS_MAX_SETTLE_MS}
+                content, _ = await render_browserless_content(url, plan)
+            return content
+    except BrowserlessUnavailableError as e:
+        print(f"Browserless not available for {url}: {e}")
+    return None
+
+async def render_browserless_content(url, plan):
+    if BROWSERLESS_CDP_ENABLED and WEBSOCKETS_AVAILABLE:
+        try:
+            rendered = await BrowserlessCDPPool.fetch(url, plan)
+            CircuitBreakers.get('browserless').record_success()
+            return rendered
+        except Exception as e:
+            print(f"Browserless CDP fetch failed for {url}, falling back to /content: {e}")
+    return await fetch_browserless_rest_content(url, plan), None
+
+async def fetch_browserless_rest_content(url, plan):
+    try:
+        browserless_url = f"{BROWSERLESS_URL}/content"
+        params = browserless_params()
+
+        browserless_data = {
+            "url": url,
+            **RequestBlocking.content_options(url),
+            "gotoOptions": {"waitUntil": "networkidle0", "timeout": REQUEST_TIMEOUT * 1000},
+            "bestAttempt": True,
+            "setJavaScriptEnabled": True,
+        }
+        if plan['wait'] == 'adaptive':
+            browserless_data["gotoOptions"]["waitUntil"] = "domcontentloaded"
+            browserless_data["waitForFunction"] = {
+                "fn": RENDER_READY_FUNCTION,
+                "polling": 100,
+                "timeout": int(plan['settle_ms'])
+            }
+        if PROXY_USERNAME and PROXY_PASSWORD:
+            browserless_data["authenticate"] = {
+                "username": PROXY_USERNAME,
+                "password": PROXY_PASSWORD
+            }
+
+        headers = {
+            'Cache-Control': 'no-cache',
+            'Content-Type': 'application/json'
+        }
+
+        client = HTTPClientManager.get_async_client()
+        async with client.stream("POST", browserless_url, params=params, headers=headers, content=json.dumps(browserless_data), timeout=REQUEST_TIMEOUT * 2) as response:
+            response.raise_for_status()
+            CircuitBreakers.get('browserless').record_success()
+            return await read_capped_body(url, response)
+    except httpx.RequestError as e:
+        print(f"An error occurred while requesting Browserless for {url}: {e}")
+        CircuitBreakers.get('browserless').record_failure(type(e).__name__)
+    except httpx.HTTPStatusError as e:
+        print(f"HTTP error occurred with Browserless: {e}")
+        if e.response.status_code >= 500 or e.response.status_code == 429:
+            CircuitBreakers.get('browserless').record_failure(f"HTTP {e.response.status_code}")
+        else:
+            CircuitBreakers.get('browserless').record_success()
+    except UnsupportedContentError as e:
+        print(f"Browserless returned no document for {url}: {e}")
+    return None
+
+_VISIBLE_TEXT_STRIP = re.compile(r'<script.*?</script>|<style.*?</style>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+
+def is_usable_content(html) -> bool:
+    """Cheap check that a fetched document carries some visible text."""
+    if not html or not html.strip():
+        return False
+    text = _VISIBLE_TEXT_STRIP.sub(' ', html)
+    return len(text.split()) >= FETCH_MIN_CONTENT_WORDS
+
+async def fetch_rendered_content(url):
+    # The rendered page still hits the origin, so it shares the host's politeness slot and circuit.
+    if CircuitBreakers.for_host(url).is_open():
+        print(f"Skipping Browserless fetch of {url}: host circuit is open")
+        return None
+    try:
+        async with HostScheduler.slot(url):
+            started = time.monotonic()
+            content = await fetch_browserless_content(url)
+    except HostBlockedError as e:
+        print(f"Skipping Browserless fetch of {url}: {e}")
+        return None
+    result = {"content": content, "source": "browserless", "not_modified": False} if content is not None else None
+    await DomainRouter.record(url, 'browserless', result, time.monotonic() - started)
+    return result
+
+class FetchHedging:
+    """Latency-percentile hedging between direct and Browserless fetches.
+
+    The hedge delay is the FETCH_HEDGE_PERCENTILE of recent successful
+    direct fetch latencies, clamped to [FETCH_HEDGE_MIN_DELAY,
+    REQUEST_TIMEOUT]. Until enough samples exist FETCH_HEDGE_INITIAL_DELAY
+    is used.
+    """
+    _latencies = deque(maxlen=500)
+    _min_samples = 20
+    _stats = {"fetches": 0, "hedged": 0, "direct_wins": 0, "browserless_wins": 0, "cancelled": 0}
+    _lock = threading.Lock()
+
+    @classmethod
+    def record_latency(cls, seconds: float):
+        with cls._lock:
+            cls._latencies.append(seconds)
+
+    @classmethod
+    def hedge_delay(cls) -> float:
+        with cls._lock:
+            samples = sorted(cls._latencies)
+        if len(samples) < cls._min_samples:
+            delay = FETCH_HEDGE_INITIAL_DELAY
+        else:
+            index = min(len(samples) - 1, int(FETCH_HEDGE_PERCENTILE * len(samples)))
+            delay = samples[index]
+        return min(max(delay, FETCH_HEDGE_MIN_DELAY), REQUEST_TIMEOUT)
+
+    @classmethod
+    def _count(cls, stat: str):
+        with cls._lock:
+            cls._stats[stat] += 1
+
+    @classmethod
+    async def fetch(cls, url, cached=None):
+        cls._count("fetches")
+        direct = asyncio.create_task(fetch_normal_content(url, cached=cached))
+        tasks = [direct]
+        try:
+            done, _ = await asyncio.wait({direct}, timeout=cls.hedge_delay())
+            if done:
+                result = direct.result()
+                if result and (result['not_modified'] or is_usable_content(result['content'])):
+                    cls._count("direct_wins")
+                    return result
+                # The direct fetch came back early but useless: go straight to Browserless.
+                rendered = await fetch_rendered_content(url)
+                if rendered and is_usable_content(rendered['content']):
+                    cls._count("browserless_wins")
+                    return rendered
+                return result or rendered
+
+            cls._count("hedged")
+            print(f"Direct fetch for {url} is slow, hedging with Browserless")
+            rendered = asyncio.create_task(fetch_rendered_content(url))
+            tasks.append(rendered)
+            pending = {direct, rendered}
+            fallback = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if isinstance(task.exception(), UnsupportedContentError):
+                        raise task.exception()
+                    if task.exception() is not None:
+                        print(f"Hedged fetch for {url} failed: {task.exception()}")
+                        continue
+                    result = task.result()
+                    if result and (result['not_modified'] or is_usable_content(result['content'])):
+                        cls._count("direct_wins" if task is direct else "browserless_wins")
+                        return result
+                    fallback = fallback or result
+            return fallback
+        finally:
+            # Cancel the loser (or everything, if our caller went away).
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    cls._count("cancelled")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            stats = dict(cls._stats)
+            samples = len(cls._latencies)
+        stats.update({
+            "enabled": FETCH_HEDGING_ENABLED,
+            "latency_samples": samples,
+            "current_delay_seconds": round(cls.hedge_delay(), 3)
+        })
+        return stats
+
+fetch_flights = SingleFlight("fetch")
+page_flights = SingleFlight("page")
+
+async def fetch_content(url):
+    # Concurrent requests for the same URL wait on one upstream fetch.
+    try:
+        return await fetch_flights.do(url, lambda: _fetch_content(url))
+    except UnsupportedContentError as e:
+        print(f"Skipping {url}: {e}")
+        return None
+
+async def _fetch_content(url):
+    cached = await asyncio.to_thread(PageCache.get, url) if PAGE_CACHE_ENABLED else None
+    if cached and cached['fresh']:
+        return cached['content']
+
+    route = DomainRouter.choose(url)
+    if route == 'browserless':
+        result = await fetch_rendered_content(url)
+    else:
+        # Only direct fetches carry ETag/Last-Modified worth revalidating.
+        revalidate = cached if cached and cached['source'] == 'direct' else None
+        if FETCH_HEDGING_ENABLED:
+            result = await FetchHedging.fetch(url, cached=revalidate)
+        else:
+            result = await fetch_normal_content(url, cached=revalidate)
+            if result is None or not (result['not_modified'] or is_usable_content(result['content'])):
+                # Failed or an empty JS shell (e.g. a reprobe of a Browserless-routed domain): render it.
+                rendered = await fetch_rendered_content(url)
+                if rendered and is_usable_content(rendered['content']):
+                    result = rendered
+                else:
+                    result = result or rendered
+
+    if result and result['not_modified']:
+        await asyncio.to_thread(PageCache.refresh, url)
+        return result['content']
+
+    content = result['content'] if result else None
+    if content and content.strip():
+        # An unusable direct response would otherwise be served from cache for PAGE_CACHE_TTL.
+        if PAGE_CACHE_ENABLED and (result['source'] != 'direct' or is_usable_content(content)):
+            await asyncio.to_thread(
+                PageCache.put, url, content, result['source'],
+                etag=result.get('etag'), last_modified=result.get('last_modified')
+            )
+    elif cached:
+        print(f"Serving stale cached copy of {url}")
+        return cached['content']
+
+    return content
+
+async def fetch_transcript_list(video_id: str):
+    breaker = CircuitBreakers.get('youtube')
+    breaker.check()
+    try:
+        async with HostScheduler.slot("https://www.youtube.com/"):
+            transcript_list = await asyncio.to_thread(_fetch_transcript_list, video_id)
+    except Exception as e:
+        # Missing or disabled transcripts still mean YouTube answered; only IP blocks open the circuit.
+        if is_youtube_blocked_error(str(e)):
+            breaker.trip("YouTube is blocking requests, pausing video requests to prevent a permanent ban")
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return transcript_list
+
+def _fetch_transcript_list(video_id: str):
+    proxies = get_proxies(without=True)
+    if proxies:
+        try:
+            return YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies)
+        except TypeError:
+            return YouTubeTranscriptApi.get_transcript(video_id)
+    return YouTubeTranscriptApi.get_transcript(video_id)
+
+async def get_transcript(video_id: str, format: str = "markdown"):
+    try:
+        video_url = f"https://www.youtube.com/watch?v={video_id}"
+        transcript_list, video_page = await asyncio.gather(
+            fetch_transcript_list(video_id),
+            fetch_content(video_url)
+        )
+        transcript = " ".join([entry['text'] for entry in transcript_list])
+        title = extract_title(video_page)
+
+        if format == "json":
+            return JSONResponse({"url": video_url, "title": title, "transcript": transcript})
+        return PlainTextResponse(f"Title: {title}\n\nURL Source: {video_url}\n\nTranscript:\n{transcript}")
+    except Exception as e:
+        return PlainTextResponse(f"Failed to retrieve transcript: {e}")
+
+def extract_title(html_content):
+    if html_content:
+        return parse_document(html_content).title()
+    return 'No title'
+
+def title_from_soup(soup):
+    title = soup.find("title")
+    return title.string.replace(" - YouTube", "") if title and title.string else 'No title'
+
+REMOVED_TAGS = frozenset(["script", "style", "header", "footer", "noscript", "form", "input", "textarea", "select", "option", "button", "svg", "iframe", "object", "embed", "applet", "nav", "navbar"])
+REMOVED_IDS = ['layers']
+STRIPPED_ATTRIBUTES = ('class', 'id', 'style')
+
+def clean_html(soup):
+    """Strip non-content elements, presentational attributes and comments in place.
+
+    A single document-order walk collects everything to remove and skips
+    the subtrees of removed elements, instead of one find_all per rule.
+    """
+    removed = []
+    comments = []
+    removed_ids = set()
+    stack = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Comment):
+            comments.append(node)
+            continue
+        if not isinstance(node, Tag):
+            continue
+        if node.name in REMOVED_TAGS:
+            removed.append(node)
+            continue
+        # Only the first element with each removed id goes, as soup.find(id=...) did.
+        tag_id = node.attrs.get('id')
+        if tag_id in REMOVED_IDS and tag_id not in removed_ids:
+            removed_ids.add(tag_id)
+            removed.append(node)
+            continue
+        if any(attribute in node.attrs for attribute in STRIPPED_ATTRIBUTES):
+            node.attrs = {key: value for key, value in node.attrs.items() if key not in STRIPPED_ATTRIBUTES}
+        stack.extend(reversed(node.contents))
+
+    for comment in comments:
+        comment.extract()
+    for tag in removed:
+        tag.decompose()
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+def filter_images_by_size_and_limit(soup, base_url):
+    """Keep at most MAX_IMAGES_PER_SITE images with a src, in place."""
+    images = soup.find_all('img')
+    
+    if MAX_IMAGES_PER_SITE == 0:
+        for img in images:
+            img.decompose()
+        return
+    
+    valid_images = 0
+    
+    for img in images:
+        src = img.get('src')
+        if valid_images >= MAX_IMAGES_PER_SITE or not src:
+            img.decompose()
+            continue
+            
+        valid_images += 1
+
+class SoupDocument:
+    """Document API over BeautifulSoup with the pure-Python html.parser (the reference backend)."""
+    name = 'html.parser'
+
+    def __init__(self, html: str):
+        self.soup = BeautifulSoup(html, 'html.parser')
+
+    def title(self):
+        return title_from_soup(self.soup)
+
+    def clean(self):
+        clean_html(self.soup)
+
+    def filter_images(self, base_url: str):
+        filter_images_by_size_and_limit(self.soup, base_url)
+
+    def to_html(self) -> str:
+        return str(self.soup)
+
+    def html_parts(self, node=None):
+        for child in (node or self.soup).contents:
+            if isinstance(child, Tag):
+                yield child if child.name in FLATTENED_TAGS else child.decode()
+            else:
+                yield child.output_ready()
+
+    def attributes(self, node) -> dict:
+        return node.attrs
+
+    # Tree primitives used by extract_main_content.
+
+    def body(self):
+        # html.parser does not synthesise <body> for fragments.
+        return self.soup.body or self.soup
+
+    def elements(self, tags):
+        return self.soup.find_all(list(tags))
+
+    def parent(self, node):
+        return node.parent
+
+    def node_key(self, node):
+        return id(node)
+
+    def tag_name(self, node):
+        return node.name
+
+    def text_of(self, node) -> str:
+        return node.get_text()
+
+    def link_text_length(self, node) -> int:
+        return sum(text_length(link.get_text()) for link in node.find_all('a'))
+
+    def child_elements(self, node):
+        return [child for child in node.children if isinstance(child, Tag)]
+
+    def text_events(self, node):
+        yield node, True
+        stack = [(node, iter(node.contents))]
+        while stack:
+            element, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield element, False
+            elif isinstance(child, Tag):
+                yield child, True
+                stack.append((child, iter(child.contents)))
+            elif type(child) in (NavigableString, CData):
+                yield str(child)
+
+    def keep_only(self, node, keys):
+        for child in list(node.contents):
+            if not (isinstance(child, Tag) and id(child) in keys):
+                child.extract()
+
+    def remove(self, node):
+        node.decompose()
+
+class LxmlDocument:
+    """Document API over lxml.html (libxml2)."""
+    name = 'lxml'
+
+    def __init__(self, html: str):
+        # Without huge_tree libxml2 silently drops everything nested deeper than 256 elements.
+        parser = lxml.html.HTMLParser(huge_tree=True)
+        try:
+            self.root = lxml.html.document_fromstring(html, parser=parser)
+        except ValueError:
+            # Unicode input with an XML encoding declaration has to go in as bytes.
+            self.root = lxml.html.document_fromstring(html.encode('utf-8', 'surrogatepass'), parser=parser)
+        except lxml.etree.ParserError:
+            self.root = lxml.html.document_fromstring("<html></html>")
+        self._keyed = {}
+
+    def title(self):
+        title = self.root.find('.//title')
+        if title is None or len(title) or not title.text:
+            return 'No title'
+        return title.text.replace(" - YouTube", "")
+
+    def clean(self):
+        for element in list(self.root.iter(*REMOVED_TAGS)):
+            element.drop_tree()
+
+        for id_ in REMOVED_IDS:
+            found = self.root.xpath('//*[@id=$id]', id=id_)
+            if found:
+                found[0].drop_tree()
+
+        for element in self.root.iter(lxml.etree.Element):
+            for attribute in STRIPPED_ATTRIBUTES:
+                element.attrib.pop(attribute, None)
+
+        for comment in list(self.root.iter(lxml.etree.Comment)):
+            comment.drop_tree()
+
+    def filter_images(self, base_url: str):
+        kept = 0
+        for img in list(self.root.iter('img')):
+            if kept >= MAX_IMAGES_PER_SITE or not img.get('src'):
+                img.drop_tree()
+            else:
+                kept += 1
+
+    def to_html(self) -> str:
+        return lxml.html.tostring(self.root, encoding='unicode')
+
+    def html_parts(self, node=None):
+        if node is None:
+            yield self.root
+            return
+        if node.text:
+            yield escape_html(node.text, quote=False)
+        for child in node:
+            if isinstance(child.tag, str) and child.tag in FLATTENED_TAGS:
+                yield child
+            else:
+                yield lxml.html.tostring(child, encoding='unicode', with_tail=False)
+            if child.tail:
+                yield escape_html(child.tail, quote=False)
+
+    def attributes(self, node) -> dict:
+        return dict(node.attrib)
+
+    # Tree primitives used by extract_main_content. lxml only reuses an element's
+    # proxy object while it is referenced, so keyed proxies are kept alive.
+
+    def body(self):
+        return self.root.body
+
+    def elements(self, tags):
+        return self.root.iter(*tags)
+
+    def parent(self, node):
+        return node.getparent()
+
+    def node_key(self, node):
+        self._keyed[id(node)] = node
+        return id(node)
+
+    def tag_name(self, node):
+        return node.tag
+
+    def text_of(self, node) -> str:
+        return node.text_content()
+
+    def link_text_length(self, node) -> int:
+        return sum(text_length(link.text_content()) for link in node.iter('a'))
+
+    def child_elements(self, node):
+        return [child for child in node if isinstance(child.tag, str)]
+
+    def text_events(self, node):
+        yield node, True
+        if node.text:
+            yield node.text
+        stack = [(node, iter(node))]
+        while stack:
+            element, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield element, False
+                if stack and element.tail:
+                    yield element.tail
+            elif isinstance(child.tag, str):
+                yield child, True
+                if child.text:
+                    yield child.text
+                stack.append((child, iter(child)))
+            elif child.tail:
+                # Comments and processing instructions: only their tail is page text.
+                yield child.tail
+
+    def keep_only(self, node, keys):
+        node.text = None
+        for child in list(node):
+            if isinstance(child.tag, str) and id(child) in keys:
+                child.tail = None
+            else:
+                node.remove(child)
+
+    def remove(self, node):
+        node.drop_tree()
+
+class LexborDocument:
+    """Document API over selectolax's lexbor engine."""
+    name = 'selectolax'
+
+    _noscript = re.compile(r'<noscript\b.*?</noscript\s*>', re.IGNORECASE | re.DOTALL)
+
+    def __init__(self, html: str):
+        # lexbor parses <noscript> as markup (scripting disabled), so a tracking pixel in a
+        # head <noscript> would close the head early and drag <title> into the body.
+        # <noscript> is dropped by clean() anyway, so remove it before parsing.
+        self.tree = LexborHTMLParser(self._noscript.sub('', html))
+
+    def title(self):
+        title = self.tree.css_first('title')
+        text = title.text() if title is not None else None
+        return text.replace(" - YouTube", "") if text else 'No title'
+
+    def clean(self):
+        self.tree.strip_tags(list(REMOVED_TAGS))
+
+        for id_ in REMOVED_IDS:
+            found = self.tree.css_first(f'[id="{id_}"]')
+            if found is not None:
+                found.decompose()
+
+        comments = []
+        for node in self.tree.root.traverse(include_text=True):
+            if node.is_comment_node:
+                comments.append(node)
+            elif node.is_element_node:
+                attributes = node.attrs
+                for attribute in STRIPPED_ATTRIBUTES:
+                    if attribute in attributes:
+                        del attributes[attribute]
+        for comment in comments:
+            comment.decompose()
+
+    def filter_images(self, base_url: str):
+        kept = 0
+        for img in self.tree.css('img'):
+            if kept >= MAX_IMAGES_PER_SITE or not img.attributes.get('src'):
+                img.decompose()
+            else:
+                kept += 1
+
+    def to_html(self) -> str:
+        # lexbor writes U+00A0 back as &nbsp;, which html2text would turn into a plain space.
+        return (self.tree.html or "").replace("&nbsp;", "\xa0")
+
+    def html_parts(self, node=None):
+        if node is None:
+            yield self.tree.root
+            return
+        for child in node.iter(include_text=True):
+            if child.tag in FLATTENED_TAGS:
+                yield child
+            else:
+                yield (child.html or "").replace("&nbsp;", "\xa0")
+
+    def attributes(self, node) -> dict:
+        return node.attributes
+
+    # Tree primitives used by extract_main_content. Node wrappers are created per
+    # access, so nodes are identified by their lexbor address.
+
+    def body(self):
+        return self.tree.body
+
+    def elements(self, tags):
+        return self.tree.css(', '.join(tags))
+
+    def parent(self, node):
+        return node.parent
+
+    def node_key(self, node):
+        return node.mem_id
+
+    def tag_name(self, node):
+        return node.tag
+
+    def text_of(self, node) -> str:
+        return node.text(deep=True)
+
+    def link_text_length(self, node) -> int:
+        return sum(text_length(link.text(deep=True)) for link in node.css('a'))
+
+    def child_elements(self, node):
+        return list(node.iter())
+
+    def text_events(self, node):
+        yield node, True
+        stack = [(node, node.iter(include_text=True))]
+        while stack:
+            element, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield element, False
+            elif child.tag == '-text':
+                yield child.text_content
+            elif not child.tag.startswith('-'):
+                yield child, True
+                stack.append((child, child.iter(include_text=True)))
+
+    def keep_only(self, node, keys):
+        for child in list(node.iter(include_text=True)):
+            if child.mem_id not in keys:
+                child.decompose()
+
+    def remove(self, node):
+        node.decompose()
+
+HTML_PARSER_BACKENDS = {
+    'html.parser': (SoupDocument, True),
+    'lxml': (LxmlDocument, LXML_AVAILABLE),
+    'selectolax': (LexborDocument, SELECTOLAX_AVAILABLE),
+}
+
+def get_document_backend(name: str = None):
+    """Document class for HTML_PARSER (or `name`), falling back to html.parser when unavailable."""
+    backend, available = HTML_PARSER_BACKENDS.get(name or HTML_PARSER, (SoupDocument, False))
+    return backend if available else SoupDocument
+
+if get_document_backend() is SoupDocument and HTML_PARSER != 'html.parser':
+    print(f"HTML parser backend '{HTML_PARSER}' is not available, using html.parser")
+
+def parse_document(html: str, backend: str = None):
+    return get_document_backend(backend)(html)
+
+MAIN_CONTENT_PARAGRAPH_TAGS = ('p', 'pre', 'td', 'blockquote')
+MAIN_CONTENT_TAG_WEIGHTS = {
+    'article': 10, 'main': 10, 'div': 5, 'section': 3, 'pre': 3, 'td': 3, 'blockquote': 3,
+    'address': -3, 'ol': -3, 'ul': -3, 'dl': -3, 'dd': -3, 'dt': -3, 'li': -3, 'aside': -5,
+    'h1': -5, 'h2': -5, 'h3': -5, 'h4': -5, 'h5': -5, 'h6': -5, 'th': -5
+}
+MAIN_CONTENT_MIN_CHARS = 250
+
+def text_length(text: str) -> int:
+    return len(' '.join(text.split()))
+
+BOILERPLATE_BLOCK_TAGS = ('div', 'section', 'aside', 'ul', 'ol', 'dl', 'table')
+BOILERPLATE_MIN_CHARS = 20
+
+def strip_boilerplate_blocks(document, boilerplate) -> List[str]:
+    """Fingerprint the page's blocks and remove those known to be boilerplate.
+
+    A fingerprint hashes a block's tag and whitespace-normalized text, so the
+    same menu or footer matches across pages whatever its markup details.
+    Blocks are fingerprinted bottom-up in one walk of the tree: a nested
+    block stands in its parent's fingerprint as its own fingerprint, so no
+    text is read twice. Only the outermost matching block is removed, and
+    never one holding half of the page's text: that is the content itself,
+    served under several URLs. Returns every fingerprint of the page (before
+    removal) for BoilerplateModel to learn from.
+    """
+    fingerprints = []
+    matched = []
+    page_length = text_length(document.text_of(document.body()))
+    # One frame per open block: [block, tag, pending text, fingerprint parts, text length].
+    stack = []
+    for event in document.text_events(document.body()):
+        if isinstance(event, str):
+            if stack:
+                stack[-1][2].append(event)
+            continue
+        node, entering = event
+        tag = document.tag_name(node)
+        if tag not in BOILERPLATE_BLOCK_TAGS:
+            continue
+        if entering:
+            stack.append([node, tag, [], [], 0])
+            continue
+        block, tag, pending, parts, length = stack.pop()
+        text = " ".join("".join(pending).split())
+        if text:
+            parts.append(text)
+            length += len(text)
+        if not parts:
+            continue
+        length += len(parts) - 1
+        fingerprint = hashlib.blake2b(f"{tag}:{' '.join(parts)}".encode("utf-8", "surrogatepass"), digest_size=8).hexdigest()
+        if stack:
+            parent = stack[-1]
+            text = " ".join("".join(parent[2]).split())
+            if text:
+                parent[3].append(text)
+                parent[4] += len(text)
+            parent[2] = []
+            parent[3].append(fingerprint)
+            parent[4] += length
+        if length < BOILERPLATE_MIN_CHARS:
+            continue
+        fingerprints.append(fingerprint)
+        if fingerprint in boilerplate and length * 2 < page_length:
+            matched.append(block)
+
+    # Decide on the outermost blocks before touching the tree: removing a block frees its descendants.
+    matched_keys = {document.node_key(block) for block in matched}
+    outermost = []
+    for block in matched:
+        node = document.parent(block)
+        while node is not None and document.node_key(node) not in matched_keys:
+            node = document.parent(node)
+        if node is None:
+            outermost.append(block)
+    for block in outermost:
+        document.remove(block)
+    return fingerprints
+
+def extract_main_content(document) -> bool:
+    """Reduce the body to its main content block, readability style.
+
+    Every paragraph-like element with some text scores its parent (and half
+    of it its grandparent) by length and comma count; candidates are then
+    discounted by their link density. The best candidate is kept together
+    with the siblings that score close to it or read like prose, everything
+    else in the body is removed. Pages without a convincing candidate are
+    left untouched. Returns whether the document was reduced.
+    """
+    scores = {}
+    nodes = {}
+    for paragraph in document.elements(MAIN_CONTENT_PARAGRAPH_TAGS):
+        text = document.text_of(paragraph)
+        length = text_length(text)
+        if length < 25:
+            continue
+        points = 1 + text.count(',') + min(length // 100, 3)
+        ancestor = document.parent(paragraph)
+        for share in (1, 0.5):
+            if ancestor is None:
+                break
+            key = document.node_key(ancestor)
+            if key not in scores:
+                nodes[key] = ancestor
+                scores[key] = MAIN_CONTENT_TAG_WEIGHTS.get(document.tag_name(ancestor), 0)
+            scores[key] += points * share
+            ancestor = document.parent(ancestor)
+    if not scores:
+        return False
+
+    lengths = {}
+    def final_score(key):
+        node = nodes[key]
+        length = lengths[key] = text_length(document.text_of(node))
+        link_density = document.link_text_length(node) / length if length else 1
+        return scores[key] * (1 - link_density)
+    final = {key: final_score(key) for key in scores}
+
+    top_key = max(final, key=final.get)
+    top = nodes[top_key]
+    if lengths[top_key] < MAIN_CONTENT_MIN_CHARS:
+        return False
+    container = document.parent(top)
+    body = document.body()
+    body_key = document.node_key(body)
+    if container is None or top_key == body_key:
+        return False
+
+    threshold = max(10, final[top_key] * 0.2)
+    kept = set()
+    for sibling in document.child_elements(container):
+        key = document.node_key(sibling)
+        if key == top_key or final.get(key, float('-inf')) >= threshold:
+            kept.add(key)
+        elif document.tag_name(sibling) == 'p':
+            text = document.text_of(sibling)
+            length = text_length(text)
+            link_density = document.link_text_length(sibling) / length if length else 1
+            if (length > 80 and link_density < 0.25) or (0 < length <= 80 and link_density == 0 and re.search(r'\.( |$)', text.strip())):
+                kept.add(key)
+
+    # Walk from the container up to the body, then prune top-down along that path.
+    path = []
+    node = container
+    while document.node_key(node) != body_key:
+        path.append(node)
+        node = document.parent(node)
+        if node is None:
+            return False
+    previous = body
+    for node in reversed(path):
+        document.keep_only(previous, {document.node_key(node)})
+        previous = node
+    document.keep_only(previous, kept)
+    return True
+
+# Wrapper elements that html2text only turns into paragraph breaks; they are streamed
+# tag by tag so that the blocks inside them become separate conversion steps.
+FLATTENED_TAGS = frozenset(['html', 'body', 'div', 'section', 'article', 'main', 'aside', 'center'])
+
+def start_tag(name: str, attributes: dict) -> str:
+    parts = [name]
+    for key, value in attributes.items():
+        if value is None:
+            parts.append(key)
+            continue
+        if isinstance(value, list):
+            value = " ".join(value)
+        parts.append(f'{key}="{escape_html(value)}"')
+    return "<" + " ".join(parts) + ">"
+
+def iter_document_html(document):
+    """Serialize a document as a stream of HTML pieces, one per block.
+
+    Concatenated, the pieces are equivalent to document.to_html(). Wrapper
+    elements (FLATTENED_TAGS) are opened and closed as separate pieces so
+    their children come out one at a time; everything else is serialized
+    whole, and only when the consumer asks for it.
+    """
+    stack = [(document.html_parts(), None)]
+    while stack:
+        parts, closing = stack[-1]
+        part = next(parts, None)
+        if part is None:
+            stack.pop()
+            if closing:
+                yield closing
+        elif isinstance(part, str):
+            yield part
+        else:
+            name = document.tag_name(part)
+            yield start_tag(name, document.attributes(part))
+            stack.append((document.html_parts(part), f"</{name}>"))
+
+class BudgetedHTML2Text(html2text.HTML2Text):
+    """HTML2Text that keeps count of the characters it has written."""
+
+    def __init__(self):
+        super().__init__()
+        for option, value in HTML2TEXT_OPTIONS.items():
+            setattr(self, option, value)
+        self.written = 0
+
+    def outtextf(self, s: str) -> None:
+        self.written += len(s)
+        super().outtextf(s)
+
+def cut_markdown(markdown: str, max_chars: int) -> str:
+    """Cut markdown to max_chars at a paragraph (or at least line) break, closing an open code block."""
+    max_chars = max(0, max_chars - len("\n[/code]"))
+    if not max_chars:
+        return ""
+    cut = markdown.rfind("\n\n", 0, max_chars)
+    if cut < max_chars // 2:
+        cut = markdown.rfind("\n", 0, max_chars)
+    if cut <= 0:
+        cut = max_chars
+    markdown = markdown[:cut].rstrip()
+    if markdown.count("[code]") > markdown.count("[/code]"):
+        markdown += "\n[/code]"
+    return markdown
+
+def convert_blocks_to_markdown(parts, max_chars: int):
+    """Convert a stream of HTML pieces, stopping once max_chars of markdown are written.
+
+    The piece that crosses the budget is rolled back so the output ends on a
+    block boundary; only when that would leave less than half the budget is
+    the oversized block kept and cut at a paragraph break instead. Pieces
+    after the stop are never serialized nor parsed. Returns (markdown, truncated).
+    """
+    text_maker = BudgetedHTML2Text()
+    truncated = False
+    for part in parts:
+        mark, written = len(text_maker.outtextlist), text_maker.written
+        text_maker.feed(part)
+        if text_maker.written > max_chars:
+            truncated = True
+            if written >= max_chars // 2:
+                del text_maker.outtextlist[mark:]
+            break
+    # Same finishing steps as HTML2Text.handle().
+    text_maker.feed("")
+    markdown = text_maker.optwrap(text_maker.finish())
+    if text_maker.pad_tables:
+        markdown = html2text.pad_tables_in_text(markdown)
+    if truncated and len(markdown) > max_chars:
+        markdown = cut_markdown(markdown, max_chars)
+    return markdown, truncated
+
+def parse_html_to_markdown(html, url, title=None, main_content=False, max_tokens=None, boilerplate=None):
+    # Parse once: title extraction and every transform share the same tree.
+    document = parse_document(html)
+    title_ = title or document.title()
+    document.clean()
+    # With a boilerplate set (possibly empty) the page's block fingerprints are returned for learning.
+    fingerprints = strip_boilerplate_blocks(document, boilerplate) if boilerplate is not None else None
+    if main_content:
+        extract_main_content(document)
+    document.filter_images(url)
+
+    # Convert block by block and stop at the token budget instead of converting everything and slicing.
+    max_tokens = max_tokens or MAX_TOKENS_PER_REQUEST
+    markdown_content, truncated = convert_blocks_to_markdown(iter_document_html(document), max_tokens * 4)
+    if truncated:
+        markdown_content += "\n\n[Content truncated due to token limit]"
+        print(f"Content truncated at {estimate_tokens(markdown_content)} tokens, limit is {max_tokens}")
+    
+    markdown_data = {
+        "title": title_,
         "url": url,
         "markdown_content": markdown_content
     }
+    if fingerprints is not None:
+        markdown_data["block_fingerprints"] = fingerprints
+    return markdown_data
 
-def get_transcript_content(video_id: str) -> str:
-    try:
-        proxies = get_proxies(without=True)
-        if proxies:
+class MarkdownCache:
+    """In-memory LRU of converted markdown keyed on the HTML content hash.
+
+    The key also covers every setting that changes the conversion output, so
+    the same page reached through another URL or a mirror reuses the entry.
+    """
+    _entries = OrderedDict()
+    _size = 0
+    _hits = 0
+    _misses = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def make_key(cls, html: str, **options) -> str:
+        settings = {
+            "max_images_per_site": MAX_IMAGES_PER_SITE,
+            "min_image_size": MIN_IMAGE_SIZE,
+            "max_tokens_per_request": MAX_TOKENS_PER_REQUEST,
+            "html_parser": get_document_backend().name,
+            "html2text": HTML2TEXT_OPTIONS,
+            **options
+        }
+        digest = hashlib.sha256(html.encode('utf-8', 'surrogatepass'))
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> dict:
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                cls._misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls._hits += 1
+            return entry
+
+    @classmethod
+    def put(cls, key: str, entry: dict):
+        entry_size = len(entry["markdown_content"])
+        max_size = MARKDOWN_CACHE_MAX_MB * 1024 * 1024
+        if entry_size > max_size:
+            return
+        with cls._lock:
+            previous = cls._entries.pop(key, None)
+            if previous is not None:
+                cls._size -= len(previous["markdown_content"])
+            cls._entries[key] = entry
+            cls._size += entry_size
+            while cls._size > max_size and cls._entries:
+                _, evicted = cls._entries.popitem(last=False)
+                cls._size -= len(evicted["markdown_content"])
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            lookups = cls._hits + cls._misses
+            return {
+                "enabled": MARKDOWN_CACHE_ENABLED,
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "hit_rate": round(cls._hits / lookups, 4) if lookups else 0.0,
+                "entries": len(cls._entries),
+                "size_bytes": cls._size,
+                "max_bytes": MARKDOWN_CACHE_MAX_MB * 1024 * 1024
+            }
+
+class BoilerplateModel:
+    """Per-domain boilerplate learned from converted pages, persisted in SQLite.
+
+    Every conversion reports the fingerprints of the page's blocks. A
+    fingerprint seen on BOILERPLATE_MIN_PAGES distinct pages of a domain
+    (mega-menus, div footers, widget rails) is boilerplate and is stripped
+    from that domain's pages from then on. Refetches of a known page and
+    the same document under another URL (same set of fingerprints) are not
+    counted twice, and each domain keeps at most BOILERPLATE_MAX_BLOCKS
+    fingerprints and pages, forgetting the rarest and oldest first. Only the
+    most recently used domains stay in memory; others are reloaded on demand.
+    """
+    _domains = OrderedDict()
+    _max_loaded_domains = 5000
+    _lock = threading.Lock()
+    _stats = {"pages_learned": 0, "pages_skipped": 0}
+
+    @staticmethod
+    def _load(domain: str) -> dict:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT fingerprint, pages, last_seen FROM boilerplate_blocks WHERE domain = ?', (domain,))
+        blocks = {row[0]: [row[1], row[2]] for row in cursor.fetchall()}
+        cursor.execute('SELECT page, seen_at FROM boilerplate_pages WHERE domain = ?', (domain,))
+        pages = {row[0]: row[1] for row in cursor.fetchall()}
+        conn.close()
+        return {"blocks": blocks, "pages": pages, "boilerplate": None, "digest": None}
+
+    @classmethod
+    async def _get(cls, domain: str) -> dict:
+        with cls._lock:
+            model = cls._domains.get(domain)
+            if model is not None:
+                cls._domains.move_to_end(domain)
+        if model is None:
+            loaded = await asyncio.to_thread(cls._load, domain)
+            with cls._lock:
+                model = cls._domains.setdefault(domain, loaded)
+                cls._domains.move_to_end(domain)
+                while len(cls._domains) > cls._max_loaded_domains:
+                    cls._domains.popitem(last=False)
+        return model
+
+    @classmethod
+    async def boilerplate_for(cls, url: str):
+        """Return the domain's boilerplate fingerprints and a digest of them for cache keys."""
+        domain = registrable_domain(url)
+        if not domain:
+            return frozenset(), None
+        model = await cls._get(domain)
+        with cls._lock:
+            if model["boilerplate"] is None:
+                model["boilerplate"] = frozenset(
+                    fingerprint for fingerprint, (pages, _) in model["blocks"].items() if pages >= BOILERPLATE_MIN_PAGES
+                )
+                model["digest"] = hashlib.sha256("".join(sorted(model["boilerplate"])).encode("ascii")).hexdigest()
+            return model["boilerplate"], model["digest"]
+
+    @staticmethod
+    def _evict(entries: dict, rank) -> list:
+        """Trim entries to 90% of BOILERPLATE_MAX_BLOCKS once over it, lowest rank first."""
+        if len(entries) <= BOILERPLATE_MAX_BLOCKS:
+            return []
+        excess = len(entries) - int(BOILERPLATE_MAX_BLOCKS * 0.9)
+        evicted = sorted(entries, key=lambda key: rank(entries[key]))[:excess]
+        for key in evicted:
+            del entries[key]
+        return evicted
+
+    @classmethod
+    async def learn(cls, url: str, fingerprints: List[str]):
+        domain = registrable_domain(url)
+        if not domain:
+            return
+        # A page is known by its URL and by its content, so URL aliases of one document count once.
+        content = "content:" + hashlib.blake2b("".join(sorted(set(fingerprints))).encode("ascii"), digest_size=16).hexdigest()
+        pages = [canonicalize_url(url), content]
+        model = await cls._get(domain)
+        now = time.time()
+        with cls._lock:
+            if any(page in model["pages"] for page in pages):
+                cls._stats["pages_skipped"] += 1
+                return
+            for page in pages:
+                model["pages"][page] = now
+            blocks = model["blocks"]
+            for fingerprint in set(fingerprints):
+                entry = blocks.setdefault(fingerprint, [0, now])
+                entry[0] += 1
+                entry[1] = now
+                if entry[0] == BOILERPLATE_MIN_PAGES:
+                    model["boilerplate"] = None
+            evicted_blocks = cls._evict(blocks, lambda entry: (entry[0], entry[1]))
+            if model["boilerplate"] is not None and not model["boilerplate"].isdisjoint(evicted_blocks):
+                model["boilerplate"] = None
+            evicted_pages = cls._evict(model["pages"], lambda seen_at: seen_at)
+            updated = [(domain, fingerprint, *blocks[fingerprint]) for fingerprint in set(fingerprints) if fingerprint in blocks]
+            cls._stats["pages_learned"] += 1
+
+        await asyncio.to_thread(cls._persist, domain, pages, now, updated, evicted_blocks, evicted_pages)
+
+    @staticmethod
+    def _persist(domain: str, pages: list, seen_at: float, updated: list, evicted_blocks: list, evicted_pages: list):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany('INSERT OR REPLACE INTO boilerplate_pages (domain, page, seen_at) VALUES (?, ?, ?)', [(domain, page, seen_at) for page in pages])
+        cursor.executemany('''
+            INSERT OR REPLACE INTO boilerplate_blocks (domain, fingerprint, pages, last_seen)
+            VALUES (?, ?, ?, ?)
+        ''', updated)
+        cursor.executemany('DELETE FROM boilerplate_blocks WHERE domain = ? AND fingerprint = ?', [(domain, key) for key in evicted_blocks])
+        cursor.executemany('DELETE FROM boilerplate_pages WHERE domain = ? AND page = ?', [(domain, key) for key in evicted_pages])
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats.update({
+                "enabled": BOILERPLATE_STRIPPING,
+                "min_pages": BOILERPLATE_MIN_PAGES,
+                "domains_loaded": len(cls._domains),
+                "boilerplate_blocks": sum(
+                    sum(1 for pages, _ in model["blocks"].values() if pages >= BOILERPLATE_MIN_PAGES)
+                    for model in cls._domains.values()
+                )
+            })
+        return stats
+
+class ConversionTimeoutError(Exception):
+    pass
+
+def convert_html_bytes(html_bytes: bytes, url: str, title=None, main_content=False, max_tokens=None, boilerplate=None) -> dict:
+    """Process pool entry point: raw HTML bytes in, markdown dict out."""
+    return parse_html_to_markdown(html_bytes.decode('utf-8', 'surrogatepass'), url, title, main_content, max_tokens, boilerplate)
+
+def warm_conversion_worker() -> int:
+    """Process pool no-op; running it makes a worker spawn and import this module."""
+    return os.getpid()
+
+class ConversionPool:
+    """Process pool that runs parse_html_to_markdown off the server's GIL.
+
+    Workers are spawned (not forked) so they never inherit the event loop,
+    connection pools or threads. At most CONVERSION_WORKERS conversions run
+    at once and later ones wait (up to CONVERSION_QUEUE_TIMEOUT), so a job
+    never sits in a worker's queue where its timeout would run behind a slow
+    page. A conversion exceeding
+    CONVERSION_TIMEOUT kills the pool's processes and starts a fresh pool;
+    conversions that were cut short with it are retried once.
+    """
+    _executor = None
+    _semaphore = None
+    _generation = 0
+    _lock = threading.Lock()
+    _stats = {"conversions": 0, "timeouts": 0, "restarts": 0, "retried": 0, "queue_timeouts": 0, "waiting": 0}
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return CONVERSION_WORKERS > 0
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=CONVERSION_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                cls._generation += 1
+            return cls._executor, cls._generation
+
+    @classmethod
+    async def start(cls):
+        if not cls.enabled():
+            return
+        executor, _ = cls._get_executor()
+        # Workers are spawned lazily, one per submitted call, so the first pages would
+        # otherwise pay for interpreter start-up and imports inside CONVERSION_TIMEOUT.
+        # A worker that is up first can take several no-ops, so keep submitting until each has answered.
+        started = time.monotonic()
+        ready = set()
+        try:
+            while len(ready) < CONVERSION_WORKERS:
+                remaining = CONVERSION_TIMEOUT - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                warmups = [asyncio.wrap_future(executor.submit(warm_conversion_worker)) for _ in range(CONVERSION_WORKERS)]
+                ready.update(await asyncio.wait_for(asyncio.gather(*warmups), remaining))
+                if len(ready) < CONVERSION_WORKERS:
+                    await asyncio.sleep(0.1)
+        except Exception as e:
+            print(f"Conversion pool warm-up incomplete ({len(ready)}/{CONVERSION_WORKERS} workers ready): {e!r}")
+            return
+        print(f"Conversion pool started with {len(ready)} worker processes in {time.monotonic() - started:.1f}s")
+
+    @classmethod
+    def _restart(cls, generation: int):
+        with cls._lock:
+            if generation != cls._generation or cls._executor is None:
+                return
+            executor = cls._executor
+            cls._executor = None
+            cls._stats["restarts"] += 1
+        # ProcessPoolExecutor cannot cancel a running call, so the stuck worker is killed.
+        for process in list(getattr(executor, '_processes', {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    async def convert(cls, html: str, url: str, title=None, main_content=False, max_tokens=None, boilerplate=None) -> dict:
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(CONVERSION_WORKERS)
+        html_bytes = html.encode('utf-8', 'surrogatepass')
+
+        cls._stats["waiting"] += 1
+        try:
+            await asyncio.wait_for(cls._semaphore.acquire(), CONVERSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            cls._stats["queue_timeouts"] += 1
+            raise ConversionTimeoutError(f"No conversion worker free after {CONVERSION_QUEUE_TIMEOUT:.0f}s")
+        finally:
+            cls._stats["waiting"] -= 1
+
+        try:
+            for attempt in range(2):
+                executor, generation = cls._get_executor()
+                future = asyncio.wrap_future(executor.submit(convert_html_bytes, html_bytes, url, title, main_content, max_tokens, boilerplate))
+                try:
+                    result = await asyncio.wait_for(future, CONVERSION_TIMEOUT)
+                    cls._stats["conversions"] += 1
+                    return result
+                except asyncio.TimeoutError:
+                    cls._stats["timeouts"] += 1
+                    cls._restart(generation)
+                    raise ConversionTimeoutError(f"Converting {url} took longer than {CONVERSION_TIMEOUT:.0f}s")
+                except BrokenProcessPool:
+                    # Another conversion's timeout (or a crashed worker) took the pool down.
+                    cls._restart(generation)
+                    if attempt:
+                        raise
+                    cls._stats["retried"] += 1
+        finally:
+            cls._semaphore.release()
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            executor = cls._executor
+            cls._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+            print("Conversion pool stopped")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        stats = dict(cls._stats)
+        stats.update({
+            "enabled": cls.enabled(),
+            "workers": CONVERSION_WORKERS,
+            "timeout_seconds": CONVERSION_TIMEOUT,
+            "queue_timeout_seconds": CONVERSION_QUEUE_TIMEOUT
+        })
+        return stats
+
+async def convert_html_to_markdown(html, url, title=None, main_content=None, max_tokens=None):
+    if main_content is None:
+        main_content = MAIN_CONTENT_EXTRACTION
+    max_tokens = max_tokens or MAX_TOKENS_PER_REQUEST
+    boilerplate, boilerplate_digest = await BoilerplateModel.boilerplate_for(url) if BOILERPLATE_STRIPPING else (None, None)
+    key = MarkdownCache.make_key(
+        html, main_content=main_content, max_tokens_per_request=max_tokens, boilerplate=boilerplate_digest
+    ) if MARKDOWN_CACHE_ENABLED else None
+    cached = MarkdownCache.get(key) if key else None
+
+    if cached is None:
+        # Parsing and html2text are CPU-bound: run them in the process pool, or at least off the event loop.
+        if ConversionPool.enabled():
             try:
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id, proxies=proxies)
-            except TypeError:
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
+                markdown_data = await ConversionPool.convert(html, url, title, main_content, max_tokens, boilerplate)
+            except (ConversionTimeoutError, BrokenProcessPool) as e:
+                print(f"Conversion failed for {url}: {e}")
+                return None
         else:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
+            markdown_data = await asyncio.to_thread(parse_html_to_markdown, html, url, title, main_content, max_tokens, boilerplate)
+        fingerprints = markdown_data.pop("block_fingerprints", None)
+        if fingerprints:
+            await BoilerplateModel.learn(url, fingerprints)
+        if key:
+            MarkdownCache.put(key, {
+                "title": None if title else markdown_data["title"],
+                "markdown_content": markdown_data["markdown_content"]
+            })
+        return markdown_data
+
+    title_ = title or cached["title"] or await asyncio.to_thread(extract_title, html)
+    return {
+        "title": title_,
+        "url": url,
+        "markdown_content": cached["markdown_content"]
+    }
+
+async def fetch_and_convert(url, title=None, main_content=None, max_tokens=None):
+    """Fetch a page and convert it, sharing the work with concurrent callers."""
+    if main_content is None:
+        main_content = MAIN_CONTENT_EXTRACTION
+    max_tokens = max_tokens or MAX_TOKENS_PER_REQUEST
+
+    async def _run():
+        html_content = await fetch_content(url)
+        if not html_content:
+            return None
+        return await convert_html_to_markdown(html_content, url, title=title, main_content=main_content, max_tokens=max_tokens)
+
+    markdown_data = await page_flights.do((url, title, main_content, max_tokens), _run)
+    return dict(markdown_data) if markdown_data else None
+
+async def get_transcript_content(video_id: str) -> str:
+    try:
+        transcript_list = await fetch_transcript_list(video_id)
         return " ".join([entry['text'] for entry in transcript_list])
     except Exception as e:
-        error_msg = str(e)
-        print(f"Failed to get transcript for {video_id}: {error_msg}")
-        
-        if YouTubeRateLimitManager.is_youtube_blocked_error(error_msg):
-            YouTubeRateLimitManager.disable_videos_temporarily()
-        
+        print(f"Failed to get transcript for {video_id}: {e}")
         return ""
 
-def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
+async def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
     """AI reranker specifically for videos with transcript content"""
-    client = None
     model = None
     
     class VideoResultItem(BaseModel):
@@ -1250,15 +4012,6 @@ def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
     if not AI_API_KEY or not AI_BASE_URL:
         raise ValueError("AI_API_KEY and AI_BASE_URL must be set for AI integration")
     
-    import openai
-    client = openai.OpenAI(
-        api_key=AI_API_KEY,
-        base_url=AI_BASE_URL,
-        default_headers={
-            "HTTP-Referer": "https://github.com/lucanori/web2md",
-            "X-Title": "Web2MD"
-        }
-    )
     model = AI_MODEL
     
     filtered_results = []
@@ -1277,7 +4030,7 @@ def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
             video_id_match = re.search(r"v=([^&]+)", result.get("url", ""))
             if video_id_match:
                 video_id = video_id_match.group(1)
-                transcript = get_transcript_content(video_id)
+                transcript = await get_transcript_content(video_id)
                 enhanced_result["content"] = transcript[:3000]
             else:
                 enhanced_result["content"] = result.get("content", "")
@@ -1300,7 +4053,7 @@ def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
             for item in batch
         ]
 
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model=model,
             stream=False,
             messages=[
@@ -1338,8 +4091,7 @@ def reranker_ai_videos(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
 
     return {"results": filtered_results, "query": query}
 
-def rerenker_ai(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
-    client = None
+async def rerenker_ai(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
     model = None
     class ResultItem(BaseModel):
         title: str
@@ -1357,15 +4109,6 @@ def rerenker_ai(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict
     if not AI_API_KEY or not AI_BASE_URL:
         raise ValueError("AI_API_KEY and AI_BASE_URL must be set for AI integration")
     
-    import openai
-    client = openai.OpenAI(
-        api_key=AI_API_KEY,
-        base_url=AI_BASE_URL,
-        default_headers={
-            "HTTP-Referer": "https://github.com/lucanori/web2md",
-            "X-Title": "Web2MD"
-        }
-    )
     model = AI_MODEL
     
     filtered_results = []
@@ -1388,7 +4131,7 @@ def rerenker_ai(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict
             for item in batch
         ]
 
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model=model,
             stream=False,
             messages=[
@@ -1418,8 +4161,7 @@ def rerenker_ai(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict
 
     return {"results": filtered_results, "query": query}
 
-def reranker_ai_images(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
-    client = None
+async def reranker_ai_images(data: Dict[str, List[dict]], max_token: int = 8000) -> List[dict]:
     model = None
     
     class ImageResultItem(BaseModel):
@@ -1445,15 +4187,6 @@ def reranker_ai_images(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
     if not AI_API_KEY or not AI_BASE_URL:
         raise ValueError("AI_API_KEY and AI_BASE_URL must be set for AI integration")
     
-    import openai
-    client = openai.OpenAI(
-        api_key=AI_API_KEY,
-        base_url=AI_BASE_URL,
-        default_headers={
-            "HTTP-Referer": "https://github.com/lucanori/web2md",
-            "X-Title": "Web2MD"
-        }
-    )
     model = AI_MODEL
     
     filtered_results = []
@@ -1480,7 +4213,7 @@ def reranker_ai_images(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
             for item in batch
         ]
 
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model=model,
             stream=False,
             messages=[
@@ -1517,28 +4250,359 @@ def reranker_ai_images(data: Dict[str, List[dict]], max_token: int = 8000) -> Li
 
     return {"results": filtered_results, "query": query}
 
-def searxng(query: str, categories: str = "general") -> dict:
-    searxng_url = f"{SEARXNG_URL}/search?q={query}&categories={categories}&format=json"
+class SearxngCache:
+    """Short-lived cache of SearXNG answers keyed on (normalized query, category)."""
+    _entries = OrderedDict()
+    _hits = 0
+    _misses = 0
+    _lock = threading.Lock()
+    flights = SingleFlight("searxng")
+
+    @staticmethod
+    def make_key(query: str, categories: str) -> tuple:
+        return (" ".join(query.casefold().split()), categories)
+
+    @classmethod
+    def get(cls, key: tuple) -> dict:
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del cls._entries[key]
+                cls._misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls._hits += 1
+            return entry[1]
+
+    @classmethod
+    def put(cls, key: tuple, results: dict):
+        with cls._lock:
+            cls._entries[key] = (time.time() + SEARXNG_CACHE_TTL, results)
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > SEARXNG_CACHE_MAX_ENTRIES:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            stats = {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "entries": len(cls._entries),
+                "ttl_seconds": SEARXNG_CACHE_TTL
+            }
+        stats.update(cls.flights.get_stats())
+        return stats
+
+async def searxng(query: str, categories: str = "general") -> dict:
+    key = SearxngCache.make_key(query, categories)
+    if SEARXNG_CACHE_TTL > 0:
+        cached = SearxngCache.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+    # Identical lookups arriving together share a single upstream request.
+    search_results = await SearxngCache.flights.do(key, lambda: _searxng_request(query, categories, key))
+    return copy.deepcopy(search_results)
+
+async def _searxng_request(query: str, categories: str, key: tuple) -> dict:
+    params = {"q": query, "categories": categories, "format": "json"}
+    breaker = CircuitBreakers.get('searxng')
+    if not breaker.allow():
+        print("SearXNG circuit is open, failing fast")
+        return {"results": [{"error": f"Search is temporarily unavailable, retry in {breaker.remaining_cooldown()}s"}]}
     try:
-        response = httpx.get(searxng_url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+        response = await HTTPClientManager.get_async_client().get(f"{SEARXNG_URL}/search", params=params, headers=HEADERS, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
     except httpx.RequestError as e:
         print(f"SearXNG request error: {e}")
+        breaker.record_failure(type(e).__name__)
         return {"results": [{"error": f"Search query failed with error: {e}"}]}
     except httpx.HTTPStatusError as e:
         print(f"SearXNG HTTP error: {e}")
+        if e.response.status_code >= 500 or e.response.status_code == 429:
+            breaker.record_failure(f"HTTP {e.response.status_code}")
+        else:
+            breaker.record_success()
         return {"results": [{"error": f"Search query failed with HTTP error: {e}"}]}
+    breaker.record_success()
 
     try:
         search_results = response.json()
         print(f"SearXNG response structure: {type(search_results)}, keys: {search_results.keys() if isinstance(search_results, dict) else 'not a dict'}")
+        if SEARXNG_CACHE_TTL > 0:
+            SearxngCache.put(key, search_results)
         return search_results
     except json.JSONDecodeError as e:
         print(f"SearXNG JSON decode error: {e}")
         return {"results": [{"error": f"Failed to parse search results: {e}"}]}
 
-def search(query: str, num_results: int, json_response: bool = False) -> list:
-    search_results = searxng(query)
+def allocate_token_budget(sizes: List[int], budget: int) -> List[int]:
+    """Split budget across items by water-filling.
+
+    Every item is offered an equal share; items smaller than their share keep
+    their full size and the unused remainder is shared among the larger ones.
+    """
+    allocation = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=sizes.__getitem__)
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allocation[index] = min(sizes[index], share)
+        remaining -= allocation[index]
+    return allocation
+
+BUDGET_TRUNCATION_NOTE = "\n\n[Content truncated to fit the token budget]"
+
+def truncate_markdown_sections(markdown: str, max_tokens: int) -> str:
+    """Truncate markdown to max_tokens, preferring to end before a heading.
+
+    Falls back to the last blank line when the last section break would keep
+    less than half the budget, and to cut_markdown (a line break, closing an
+    open [code] block) when that would too, as on pages that are mostly one
+    table or code block. Breaks inside [code] blocks are never used.
+    """
+    max_chars = max_tokens * 4 - len(BUDGET_TRUNCATION_NOTE)
+    if max_chars <= 0:
+        return BUDGET_TRUNCATION_NOTE.strip()
+
+    section_break = paragraph_break = 0
+    in_code = False
+    offset = 0
+    for line in markdown.splitlines(keepends=True):
+        if offset > max_chars:
+            break
+        stripped = line.strip()
+        if not in_code and offset:
+            if stripped.startswith("#"):
+                section_break = offset
+            elif not stripped:
+                paragraph_break = offset
+        if stripped == "[code]":
+            in_code = True
+        elif stripped == "[/code]":
+            in_code = False
+        offset += len(line)
+
+    if section_break >= max_chars // 2:
+        cut = markdown[:section_break]
+    elif paragraph_break >= max_chars // 2:
+        cut = markdown[:paragraph_break]
+    else:
+        cut = cut_markdown(markdown, max_chars)
+    return cut.rstrip() + BUDGET_TRUNCATION_NOTE
+
+def fit_pages_to_budget(pages: List[dict], max_tokens: int):
+    """Share max_tokens across converted pages and truncate the pages over their share, in place."""
+    overhead = sum(estimate_tokens(page["title"] + page["url"]) for page in pages)
+    sizes = [estimate_tokens(page["markdown_content"]) for page in pages]
+    shares = allocate_token_budget(sizes, max(0, max_tokens - overhead))
+    for page, size, share in zip(pages, sizes, shares):
+        if size > share:
+            page["markdown_content"] = truncate_markdown_sections(page["markdown_content"], share)
+            print(f"Search budget: {page['url']} truncated from {size} to {share} tokens")
+
+STOPWORDS = frozenset("""a an and are as at be but by can do does for from has have how i if in into is it its
+not of on or so than that the their then there these this to was what when where which who why will with you your""".split())
+WORD_PATTERN = re.compile(r"\w+")
+
+def lexical_terms(text: str) -> List[str]:
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        # Light stemming so "connections" matches "connection".
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def split_markdown_blocks(markdown: str) -> List[dict]:
+    """Split markdown into blank-line separated blocks, keeping [code] blocks whole.
+
+    Every block records the headings it sits under, as (level, heading) pairs.
+    """
+    blocks = []
+    headings = []
+    lines = []
+    in_code = False
+
+    def flush():
+        if lines:
+            text = "".join(lines).strip("\n")
+            if text.strip():
+                blocks.append({"text": text, "headings": list(headings)})
+            lines.clear()
+
+    for line in markdown.splitlines(keepends=True):
+        stripped = line.strip()
+        if in_code:
+            lines.append(line)
+            in_code = stripped != "[/code]"
+            continue
+        if stripped == "[code]":
+            in_code = True
+            lines.append(line)
+        elif not stripped:
+            flush()
+        elif stripped.startswith("#") and stripped.lstrip("#").startswith(" "):
+            flush()
+            level = len(stripped) - len(stripped.lstrip("#"))
+            headings[:] = [heading for heading in headings if heading[0] < level] + [(level, stripped)]
+        else:
+            lines.append(line)
+    flush()
+    return blocks
+
+def bm25_scores(documents: List[List[str]], query_terms: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    count = len(documents)
+    average_length = sum(len(terms) for terms in documents) / count if count else 0
+    frequencies = []
+    document_frequency = {}
+    for terms in documents:
+        frequency = {}
+        for term in terms:
+            frequency[term] = frequency.get(term, 0) + 1
+        frequencies.append(frequency)
+        for term in frequency:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    idf = {
+        term: math.log(1 + (count - document_frequency.get(term, 0) + 0.5) / (document_frequency.get(term, 0) + 0.5))
+        for term in set(query_terms)
+    }
+    scores = []
+    for terms, frequency in zip(documents, frequencies):
+        norm = k1 * (1 - b + b * len(terms) / average_length) if average_length else k1
+        scores.append(sum(
+            idf[term] * frequency[term] * (k1 + 1) / (frequency[term] + norm)
+            for term in idf if term in frequency
+        ))
+    return scores
+
+QUERY_COMPRESSION_MIN_SCORE = 0.25
+
+def compress_markdown(markdown: str, query: str, max_tokens: int) -> str:
+    """Keep only the passages of a page that match the query, BM25 ranked.
+
+    Blocks (paragraphs, lists, tables, code) are scored together with the
+    headings they sit under and the best ones are kept, in document order
+    and under their headings, until max_tokens is reached; blocks scoring
+    below a quarter of the best match are dropped even if there is room.
+    Pages already within budget are returned unchanged; pages with no match
+    are cut to the budget from the top, and when every match is too large on
+    its own the best one is cut to the budget instead.
+    """
+    if estimate_tokens(markdown) <= max_tokens:
+        return markdown
+    query_terms = lexical_terms(query)
+    blocks = split_markdown_blocks(markdown)
+    scores = bm25_scores(
+        [lexical_terms(" ".join(heading for _, heading in block["headings"]) + " " + block["text"]) for block in blocks],
+        query_terms
+    )
+    best = max(scores, default=0)
+    if best <= 0:
+        return truncate_markdown_sections(markdown, max_tokens)
+
+    selected = set()
+    headings_used = set()
+    used = 0
+    for index in sorted(range(len(blocks)), key=lambda i: scores[i], reverse=True):
+        # Blocks that only share a common word with the query are not worth their tokens.
+        if scores[index] < best * QUERY_COMPRESSION_MIN_SCORE:
+            break
+        block = blocks[index]
+        # Two tokens for the blank lines and the "[...]" marker around the block.
+        cost = 2 + estimate_tokens(block["text"]) + sum(
+            estimate_tokens(heading[1]) for heading in block["headings"] if heading not in headings_used
+        )
+        if used + cost > max_tokens:
+            continue
+        selected.add(index)
+        headings_used.update(block["headings"])
+        used += cost
+    if not selected:
+        # Every match is larger than the budget on its own: keep the top of the best one.
+        block = blocks[scores.index(best)]
+        headings = [heading[1] for heading in block["headings"]]
+        room = max_tokens * 4 - sum(len(heading) + 2 for heading in headings)
+        if room <= 0:
+            return truncate_markdown_sections(markdown, max_tokens)
+        return "\n\n".join(headings + [cut_markdown(block["text"], room)]).rstrip() + "\n"
+
+    parts = []
+    emitted = set()
+    previous = None
+    for index in sorted(selected):
+        block = blocks[index]
+        if previous is not None and index != previous + 1:
+            parts.append("[...]")
+        for heading in block["headings"]:
+            if heading not in emitted:
+                emitted.add(heading)
+                parts.append(heading[1])
+        parts.append(block["text"])
+        previous = index
+    return "\n\n".join(parts) + "\n"
+
+TRACKING_PARAMETERS = frozenset([
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid",
+    "mc_cid", "mc_eid", "_hsenc", "_hsmi", "ref_src", "amp"
+])
+
+def canonicalize_url(url: str) -> str:
+    """Key under which URLs of the same page compare equal.
+
+    Ignores the scheme, "www."/"m." host prefixes, default ports, fragments,
+    tracking parameters, parameter order, index-file suffixes, a trailing
+    "/amp" after a longer path and trailing slashes.
+    """
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower().rstrip(".")
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        host += f":{port}"
+
+    path = re.sub(r"/{2,}", "/", parsed.path or "/")
+    path = re.sub(r"/(index\.html?|index\.php)/?$", "/", path, flags=re.IGNORECASE)
+    # Only ".../article/amp" is an AMP variant; a page that is itself at "/amp" stays apart.
+    path = re.sub(r"(?<=[^/])/amp/?$", "/", path)
+    path = path.rstrip("/") or "/"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMETERS and not key.lower().startswith("utm_")
+    )
+    return host + path + ("?" + urlencode(query) if query else "")
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the word 3-grams of a text."""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    digests = [hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles]
+    # Count byte values per position instead of adding up 64 bits for every shingle.
+    fingerprint = 0
+    for position in range(8):
+        counts = Counter(digest[position] for digest in digests)
+        for bit in range(8):
+            ones = sum(count for value, count in counts.items() if value >> bit & 1)
+            if ones * 2 > len(digests):
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+def is_near_duplicate(fingerprint: int, fingerprints: List[int]) -> bool:
+    return any((fingerprint ^ other).bit_count() <= SEARCH_DUPLICATE_DISTANCE for other in fingerprints)
+
+async def search(query: str, num_results: int, json_response: bool = False, main_content: bool = None, max_tokens: int = None, compress: bool = None) -> list:
+    search_results = await searxng(query)
     reranked_urls = []
     
     if FILTER_SEARCH_RESULT_BY_AI:
@@ -1546,49 +4610,102 @@ def search(query: str, num_results: int, json_response: bool = False) -> list:
             "query": query,
             "results": search_results["results"] if isinstance(search_results, dict) and "results" in search_results else search_results
         }
-        search_results = rerenker_ai(ai_input)
+        search_results = await rerenker_ai(ai_input)
 
     json_return = []
     markdown_return = ""
     
     results_list = search_results["results"] if isinstance(search_results, dict) and "results" in search_results else search_results
     
-    for result in results_list[:num_results]:
+    # With deduplication every result is a candidate, so duplicates can be replaced by lower-ranked results.
+    # skipped_before[i] is the number of URL duplicates between candidates i - 1 and i; they only count
+    # as removed once the search actually gets that far down the list.
+    candidates = []
+    skipped_before = []
+    seen_urls = set()
+    skipped = 0
+    duplicates = 0
+    for result in results_list if SEARCH_DEDUPLICATION else results_list[:num_results]:
         if not isinstance(result, dict) or "url" not in result or "title" not in result:
             print(f"Skipping invalid result: {result}")
             continue
-            
+        if SEARCH_DEDUPLICATION:
+            url_key = canonicalize_url(result["url"])
+            if url_key in seen_urls:
+                skipped += 1
+                continue
+            seen_urls.add(url_key)
+        candidates.append(result)
+        skipped_before.append(skipped)
+        skipped = 0
+    
+    # One budget for the whole response; no single page can use more than all of it.
+    budget = max_tokens or SEARCH_MAX_TOKENS
+    page_max_tokens = min(budget, MAX_TOKENS_PER_REQUEST)
+    semaphore = asyncio.Semaphore(max(1, SEARCH_CONCURRENCY))
+    
+    async def process_result(result):
         url = result["url"]
         title = result["title"]
         
-        reranked_urls.append({
-            "url": url,
-            "title": title,
-            "relevance": f"Query: {query}"
-        })
-        
-        if "youtube" in url:
-            video_id = re.search(r"v=([^&]+)", url)
-            if video_id:
-                if json_response:
-                    json_return.append(get_transcript(video_id.group(1), "json"))
-                else:
-                    markdown_return += get_transcript(video_id.group(1)) + "\n\n ---------------- \n\n"
-            continue
+        async with semaphore:
+            if "youtube" in url:
+                video_id = re.search(r"v=([^&]+)", url)
+                if video_id:
+                    return ("transcript", await get_transcript(video_id.group(1), "json" if json_response else "markdown"))
+                return None
             
-        html_content = fetch_content(url)
-        if html_content:
-            markdown_data = parse_html_to_markdown(html_content, url, title=title)
-            if markdown_data["markdown_content"].strip():
-                if json_response:
-                    json_return.append(markdown_data)
-                else:
-                    markdown_return += (
-                    f"Title: {markdown_data['title']}\n\n"
-                    f"URL Source: {markdown_data['url']}\n\n"
-                    f"Markdown Content:\n{markdown_data['markdown_content']}"
-                ) + "\n\n ---------------- \n\n"
-                
+            markdown_data = await fetch_and_convert(url, title=title, main_content=main_content, max_tokens=page_max_tokens)
+            if markdown_data and markdown_data["markdown_content"].strip():
+                return ("page", markdown_data)
+            return None
+    
+    # Fetch and convert candidates in parallel, one wave per round of free slots; gather keeps
+    # the SearXNG order. Near-duplicates of a higher-ranked page give their slot back.
+    processed = []
+    fingerprints = []
+    position = 0
+    while position < len(candidates) and len(processed) < num_results:
+        wave = candidates[position:position + num_results - len(processed)]
+        duplicates += sum(skipped_before[position:position + len(wave)])
+        position += len(wave)
+        for result, item in zip(wave, await asyncio.gather(*(process_result(result) for result in wave))):
+            if SEARCH_DEDUPLICATION and item and item[0] == "page":
+                fingerprint = await asyncio.to_thread(simhash, item[1]["markdown_content"])
+                if is_near_duplicate(fingerprint, fingerprints):
+                    print(f"Dropping near-duplicate result: {result['url']}")
+                    duplicates += 1
+                    continue
+                fingerprints.append(fingerprint)
+            reranked_urls.append({
+                "url": result["url"],
+                "title": result["title"],
+                "relevance": f"Query: {query}"
+            })
+            processed.append(item)
+    pages = [data for kind, data in filter(None, processed) if kind == "page"]
+    if QUERY_COMPRESSION if compress is None else compress:
+        for page in pages:
+            page["markdown_content"] = await asyncio.to_thread(
+                compress_markdown, page["markdown_content"], query, QUERY_COMPRESSION_MAX_TOKENS
+            )
+    fit_pages_to_budget(pages, budget)
+    
+    for item in processed:
+        if item is None:
+            continue
+        
+        kind, data = item
+        if json_response:
+            json_return.append(data)
+        elif kind == "transcript":
+            markdown_return += data + "\n\n ---------------- \n\n"
+        else:
+            markdown_return += (
+                f"Title: {data['title']}\n\n"
+                f"URL Source: {data['url']}\n\n"
+                f"Markdown Content:\n{data['markdown_content']}"
+            ) + "\n\n ---------------- \n\n"
     
     if json_response:
         return {
@@ -1600,17 +4717,19 @@ def search(query: str, num_results: int, json_response: bool = False) -> list:
                 "query": query,
                 "num_results": len(json_return),
                 "total_sources": len(reranked_urls),
-                "ai_reranked": FILTER_SEARCH_RESULT_BY_AI
+                "ai_reranked": FILTER_SEARCH_RESULT_BY_AI,
+                "token_budget": budget,
+                "duplicates_removed": duplicates
             }
         }
     return PlainTextResponse(markdown_return)
 
 @app.get("/images")
-def get_search_images(
+async def get_search_images(
     q: str = Query(..., description="Search images"),
     num_results: int = Query(5, description="Number of results")
     ):
-    result_list = searxng(q, categories="images")
+    result_list = await searxng(q, categories="images")
     results = result_list["results"] if isinstance(result_list, dict) and "results" in result_list else result_list
     
     if FILTER_SEARCH_RESULT_BY_AI:
@@ -1618,20 +4737,21 @@ def get_search_images(
             "query": q,
             "results": results
         }
-        reranked_results = reranker_ai_images(ai_input)
+        reranked_results = await reranker_ai_images(ai_input)
         results = reranked_results["results"]
     
     return JSONResponse(results[:num_results])
 
 @app.get("/videos")
-def get_search_videos(
+async def get_search_videos(
     q: str = Query(..., description="Search videos"),
     num_results: int = Query(5, description="Number of results"),
     format: str = Query("metadata", description="Output format (metadata, transcripts, or json)")
     ):
     
-    if YouTubeRateLimitManager.is_videos_disabled():
-        remaining = YouTubeRateLimitManager.get_remaining_cooldown()
+    youtube_circuit = CircuitBreakers.get('youtube')
+    if youtube_circuit.is_open():
+        remaining = youtube_circuit.remaining_cooldown()
         return JSONResponse(
             {
                 "error": "Video endpoint temporarily disabled due to YouTube rate limiting",
@@ -1643,7 +4763,7 @@ def get_search_videos(
             status_code=503
         )
     
-    result_list = searxng(q, categories="videos")
+    result_list = await searxng(q, categories="videos")
     results = result_list["results"] if isinstance(result_list, dict) and "results" in result_list else result_list
     
     if FILTER_SEARCH_RESULT_BY_AI:
@@ -1652,7 +4772,7 @@ def get_search_videos(
                 "query": q,
                 "results": results
             }
-            reranked_results = reranker_ai_videos(ai_input)
+            reranked_results = await reranker_ai_videos(ai_input)
             results = reranked_results["results"]
         except Exception as e:
             print(f"AI reranking failed for videos: {e}")
@@ -1665,7 +4785,7 @@ def get_search_videos(
                 video_id_match = re.search(r"v=([^&]+)", result.get("url", ""))
                 if video_id_match:
                     video_id = video_id_match.group(1)
-                    transcript = get_transcript_content(video_id)
+                    transcript = await get_transcript_content(video_id)
                     enhanced_result["full_transcript"] = transcript
             enhanced_results.append(enhanced_result)
         return JSONResponse(enhanced_results)
@@ -1677,18 +4797,21 @@ def get_search_videos(
         return JSONResponse(results[:num_results])
 
 @app.get("/search")
-def get_search_results(
+async def get_search_results(
     q: str = Query(..., description="Search query"), 
     num_results: int = Query(5, description="Number of results"),
-    format: str = Query("markdown", description="Output format (markdown or json)")):
-    result_list = search(q, num_results, format == "json")
+    format: str = Query("markdown", description="Output format (markdown or json)"),
+    main_content: Optional[bool] = Query(None, description="Keep only each page's main content (default: MAIN_CONTENT_EXTRACTION)"),
+    max_tokens: Optional[int] = Query(None, ge=1, description="Token budget shared by all results (default: SEARCH_MAX_TOKENS)"),
+    compress: Optional[bool] = Query(None, description="Keep only the passages relevant to the query (default: QUERY_COMPRESSION)")):
+    result_list = await search(q, num_results, format == "json", main_content, max_tokens, compress)
     
     if format == "json":
         return JSONResponse(result_list)
     return result_list
 
 @app.get("/auto")
-def start_auto_research(
+async def start_auto_research(
     q: str = Query(..., description="Research query"),
     ):
     try:
@@ -1705,7 +4828,7 @@ def start_auto_research(
         )
 
 @app.get("/auto/status/{request_id}")
-def get_auto_research_status(request_id: str):
+async def get_auto_research_status(request_id: str):
     try:
         status_data = QueueManager.get_status(request_id)
         return JSONResponse(status_data)
@@ -1716,9 +4839,10 @@ def get_auto_research_status(request_id: str):
         )
 
 @app.get("/status/videos")
-def get_videos_status():
-    is_disabled = YouTubeRateLimitManager.is_videos_disabled()
-    remaining = YouTubeRateLimitManager.get_remaining_cooldown()
+async def get_videos_status():
+    youtube_circuit = CircuitBreakers.get('youtube')
+    is_disabled = youtube_circuit.is_open()
+    remaining = youtube_circuit.remaining_cooldown()
     
     return JSONResponse({
         "videos_disabled": is_disabled,
@@ -1728,14 +4852,51 @@ def get_videos_status():
         "status": "disabled" if is_disabled else "available"
     })
 
+@app.get("/status/circuits")
+async def get_circuits_status():
+    return JSONResponse(CircuitBreakers.get_stats())
+
+@app.get("/status/cache")
+async def get_cache_status():
+    pages = await asyncio.to_thread(PageCache.get_stats) if PAGE_CACHE_ENABLED else {"enabled": False}
+    return JSONResponse({
+        "pages": pages,
+        "markdown": MarkdownCache.get_stats(),
+        "searxng": SearxngCache.get_stats()
+    })
+
+@app.get("/status/fetch")
+async def get_fetch_status():
+    return JSONResponse({
+        "fetch": fetch_flights.get_stats(),
+        "page": page_flights.get_stats(),
+        "hedging": FetchHedging.get_stats(),
+        "routing": DomainRouter.get_stats(),
+        "hosts": HostScheduler.get_stats(),
+        "browserless": BrowserlessAdmission.get_stats(),
+        "cdp": BrowserlessCDPPool.get_stats(),
+        "blocking": RequestBlocking.get_stats(),
+        "render": await asyncio.to_thread(RenderProfiles.get_stats),
+        "conversion": ConversionPool.get_stats(),
+        "boilerplate": BoilerplateModel.get_stats()
+    })
+
 @app.get("/r/{url:path}")
-def fetch_url(request: Request, url: str, format: str = Query("markdown", description="Output format (markdown or json)")):
+async def fetch_url(
+    request: Request,
+    url: str,
+    format: str = Query("markdown", description="Output format (markdown or json)"),
+    main_content: Optional[bool] = Query(None, description="Keep only the page's main content (default: MAIN_CONTENT_EXTRACTION)"),
+    query: Optional[str] = Query(None, description="Keep only the passages relevant to this query")):
     if "youtube" in url:
-        return get_transcript(request.query_params.get('v'), format)
+        return await get_transcript(request.query_params.get('v'), format)
     
-    html_content = fetch_content(url)
-    if html_content:
-        markdown_data = parse_html_to_markdown(html_content, url)
+    markdown_data = await fetch_and_convert(url, main_content=main_content)
+    if markdown_data and query:
+        markdown_data["markdown_content"] = await asyncio.to_thread(
+            compress_markdown, markdown_data["markdown_content"], query, QUERY_COMPRESSION_MAX_TOKENS
+        )
+    if markdown_data:
         if format == "json":
             return JSONResponse(markdown_data)
         
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+HTML Parser Backend Benchmark for web2md
+
+Converts a corpus of HTML files with every available HTML_PARSER backend,
+checks that each one produces the same markdown and title as the reference
+html.parser backend, and reports conversion throughput.
+
+Usage:
+    python3 parser_benchmark.py [FILE_OR_DIR ...] [--repeat N] [--main-content]
+
+Defaults to the fixtures/ directory next to this script. Exits with status 1
+when a backend's output differs from html.parser on any file, or when cutting
+a page to a token budget keeps less than half of that budget. With
+--main-content the comparison runs with main-content extraction enabled.
+"""
+
+import argparse
+import difflib
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+# Importing main initialises its SQLite files; keep them out of the repository.
+_scratch = tempfile.mkdtemp(prefix="web2md-benchmark-")
+os.environ.setdefault("DB_PATH", os.path.join(_scratch, "web2md.db"))
+os.environ.setdefault("PAGE_CACHE_ENABLED", "false")
+
+import main  # noqa: E402
+
+BASE_URL = "https://example.com/page"
+REFERENCE = "html.parser"
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith((".html", ".htm")))
+        elif os.path.isfile(path):
+            files.append(path)
+    return sorted(files)
+
+def convert_all(backend, documents, repeat, main_content=False):
+    main.HTML_PARSER = backend
+    outputs = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        outputs = [
+            (main.parse_html_to_markdown(html, BASE_URL, main_content=main_content)["markdown_content"], main.extract_title(html))
+            for html in documents
+        ]
+    elapsed = (time.perf_counter() - started) / repeat
+    return outputs, elapsed
+
+def first_difference(expected, actual):
+    diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(), lineterm="", n=0)
+    lines = [line for line in diff if not line.startswith(("---", "+++", "@@"))]
+    return " / ".join(lines[:2])
+
+def check_truncation(files, reference):
+    """Cut each reference page to half and a quarter of its size; every cut must keep at least half its budget."""
+    failures = 0
+    for path, (markdown, _) in zip(files, reference):
+        size = main.estimate_tokens(markdown)
+        for budget in (size // 2, size // 4):
+            if budget < 50:
+                continue
+            kept = main.estimate_tokens(main.truncate_markdown_sections(markdown, budget))
+            if not budget // 2 <= kept <= budget:
+                failures += 1
+                print(f"    truncation: {os.path.relpath(path)}: kept {kept} of {budget} tokens")
+    return failures
+
+def main_():
+    parser = argparse.ArgumentParser(description="Compare and benchmark web2md HTML parser backends")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(SCRIPT_DIR, "fixtures")])
+    parser.add_argument("--repeat", type=int, default=3, help="Conversions per file and backend (default: 3)")
+    parser.add_argument("--main-content", action="store_true", help="Compare with main-content extraction enabled")
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        print("No HTML files found")
+        return 1
+    documents = []
+    for path in files:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            documents.append(f.read())
+    total_bytes = sum(len(html) for html in documents)
+    print(f"Corpus: {len(files)} files, {total_bytes / 1024:.0f} KiB, {args.repeat} run(s) per backend\n")
+
+    reference, reference_time = convert_all(REFERENCE, documents, args.repeat, args.main_content)
+    mismatches = 0
+
+    print(f"{'backend':<12} {'time':>8} {'pages/s':>9} {'speedup':>8} {'identical':>10} {'titles':>7}")
+    print("-" * 60)
+    for backend, (_, available) in main.HTML_PARSER_BACKENDS.items():
+        if not available:
+            print(f"{backend:<12} not installed")
+            continue
+        if backend == REFERENCE:
+            outputs, elapsed = reference, reference_time
+        else:
+            outputs, elapsed = convert_all(backend, documents, args.repeat, args.main_content)
+
+        identical = sum(1 for (markdown, _), (expected, _) in zip(outputs, reference) if markdown == expected)
+        titles = sum(1 for (_, title), (_, expected) in zip(outputs, reference) if title == expected)
+        print(
+            f"{backend:<12} {elapsed:>7.3f}s {len(documents) / elapsed:>9.1f} "
+            f"{reference_time / elapsed:>7.1f}x {identical:>5}/{len(documents):<4} {titles:>3}/{len(documents)}"
+        )
+
+        for path, (markdown, title), (expected, expected_title) in zip(files, outputs, reference):
+            if markdown != expected or title != expected_title:
+                mismatches += 1
+                detail = first_difference(expected, markdown) if markdown != expected else f"title {title!r} != {expected_title!r}"
+                print(f"    differs: {os.path.relpath(path)}: {detail[:160]}")
+
+    truncation_failures = check_truncation(files, reference)
+    print()
+    if truncation_failures:
+        print(f"{truncation_failures} budget truncation(s) kept less than half their budget")
+        return 1
+    if mismatches:
+        print(f"{mismatches} backend/file combination(s) differ from {REFERENCE}")
+        return 1
+    print(f"All available backends match {REFERENCE}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())